@@ -0,0 +1,246 @@
+## benchmarks/bench.py - Offline micro/macro benchmarks with history and regression thresholds
+"""Benchmark the scoring hot paths and the app, and track them over time.
+
+Micro benchmarks (this interpreter):
+
+* ``single_engine_s``: one patient through ``make_input_dict`` →
+  ``score`` → ``results_dict``;
+* ``single_table_s``: the app's Calculate path, ``patient_key`` and a
+  risk-table ``lookup``;
+* ``single_cold_engine_s``: the rest of an uncached Calculate (monthly
+  curve, treatment grid, contributions);
+* ``batch_<n>_rows_per_s``: ``design_matrix`` + ``score`` from label codes,
+  n = 1e3 … 1e7 (in chunks of 1e6 rows above that);
+* ``score_into_1e6_rows_per_s``: ``score_into`` from label codes into
+  preallocated output columns;
+* ``lookup_ns_per_key`` (1e6 keys) and ``lookup_single_s``.
+
+Macro benchmarks:
+
+* cold import and first run in fresh interpreters (``startup_budget.measure``);
+* ``apptest_<lang>_calculate_cold_s`` / ``_warm_s``: a full rerun with the
+  Calculate button pressed (empty / warm result cache), and
+  ``apptest_<lang>_toggle_s``: a rerun after a checkbox toggle, both
+  languages, through Streamlit's headless app-testing harness.
+
+Every run is compared with ``benchmarks/budgets.json`` (``benchmarks``):
+absolute ``limits`` and a relative ``regression_tolerance`` against the
+median of the last ``history_window`` runs on the same host in
+``benchmarks/history.jsonl``.
+Metrics ending in ``_per_s`` are higher-is-better, all others lower.
+
+    python benchmarks/bench.py                # run, compare, exit status 1 on regression
+    python benchmarks/bench.py --record       # also append the run to the history
+    python benchmarks/bench.py --quick        # fewer repeats, batches up to 1e6, no app runs
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, HERE)
+
+import numpy as np  # noqa: E402
+
+BUDGETS = os.path.join(HERE, "budgets.json")
+HISTORY = os.path.join(HERE, "history.jsonl")
+BATCH_SIZES = (10**3, 10**4, 10**5, 10**6, 10**7)
+CHUNK = 10**6
+LANGUAGES = {"en": "English", "ja": "日本語"}
+
+
+def per_call(fn, repeats=7, min_time=0.1):
+    """Seconds per call of ``fn``: the fastest of ``repeats`` timed loops."""
+    fn()
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        if time.perf_counter() - start >= min_time or loops >= 1 << 20:
+            break
+        loops *= 2
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        times.append((time.perf_counter() - start) / loops)
+    return min(times)
+
+
+def micro(sizes=BATCH_SIZES, repeats=7):
+    from ibtr_contribution import contributions
+    from ibtr_counterfactual import treatment_grid
+    from ibtr_model import (CATEGORICAL, FLAGS, allocate_columns, design_matrix, design_row, make_input_dict,
+                            results_dict, risk_curves, score, score_into)
+    from ibtr_table import TABLE_SIZE, design_from_keys, lookup, model_table, patient_key
+
+    table = model_table()
+    patient = ("Under 40", "Close (<5mm)", "pT2", "Grade 2")
+    flags = dict(lvi=True, hormone_receptor=True, endocrine=True, radiation=True)
+    metrics = {
+        "single_engine_s": per_call(
+            lambda: results_dict(score(design_row(make_input_dict(*patient, **flags)))), repeats),
+        "single_table_s": per_call(
+            lambda: results_dict(lookup(table, patient_key(make_input_dict(*patient, **flags)))), repeats),
+    }
+    X1 = design_from_keys(patient_key(make_input_dict(*patient, **flags)))
+    metrics["single_cold_engine_s"] = per_call(
+        lambda: (risk_curves(X1), treatment_grid(X1), contributions(X1)), repeats)
+
+    rng = np.random.default_rng(0)
+    chunk = min(max(sizes), CHUNK)
+    frame = {column: rng.integers(0, len(levels), chunk) for column, (_, levels) in CATEGORICAL.items()}
+    frame.update({flag: rng.integers(0, 2, chunk) for flag in FLAGS})
+    frame["endocrine"] &= frame["hormone_receptor"]
+    frame["targeted"] &= frame["her2"]
+    for n in sorted(sizes):
+        part = {column: values[:min(n, CHUNK)] for column, values in frame.items()}
+
+        def run(n=n, part=part):
+            for _ in range(max(n // CHUNK, 1)):
+                score(design_matrix(part))
+
+        metrics[f"batch_{n:.0e}_rows_per_s".replace("+0", "")] = n / per_call(run, max(3, repeats // 2), 0.0)
+    out = allocate_columns(chunk)
+    metrics["score_into_1e6_rows_per_s"] = chunk / per_call(lambda: score_into(frame, out), max(3, repeats // 2), 0.0)
+
+    keys = rng.integers(0, TABLE_SIZE, 10**6)
+    metrics["lookup_ns_per_key"] = per_call(lambda: lookup(table, keys), repeats) / len(keys) * 1e9
+    metrics["lookup_single_s"] = per_call(lambda: lookup(table, 1234), repeats)
+    return metrics
+
+
+def app_runs(repeats=5):
+    """Full reruns of ``ibtr_app_en.py`` through the headless harness."""
+    from streamlit.testing.v1 import AppTest
+
+    from ibtr_cache import default_cache
+
+    metrics = {}
+    for code, lang in LANGUAGES.items():
+        at = AppTest.from_file(os.path.join(ROOT, "ibtr_app_en.py"), default_timeout=60).run()
+        at.selectbox[0].set_value(lang).run()
+        cold, warm, toggle = [], [], []
+        for i in range(repeats):
+            default_cache().clear()
+            start = time.perf_counter()
+            at.button[0].click().run()
+            cold.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            at.button[0].click().run()
+            warm.append(time.perf_counter() - start)
+            checkbox = at.checkbox[i % 3]
+            start = time.perf_counter()
+            (checkbox.uncheck() if checkbox.value else checkbox.check()).run()
+            toggle.append(time.perf_counter() - start)
+            if at.exception:
+                raise RuntimeError(f"app raised: {at.exception}")
+        metrics[f"apptest_{code}_calculate_cold_s"] = statistics.median(cold)
+        metrics[f"apptest_{code}_calculate_warm_s"] = statistics.median(warm)
+        metrics[f"apptest_{code}_toggle_s"] = statistics.median(toggle)
+    return metrics
+
+
+def startup(repeats=3):
+    from startup_budget import measure
+
+    result = measure(repeats)
+    return {key: result[key] for key in ("streamlit_import_s", "app_modules_import_s", "first_run_s")}
+
+
+def read_history(path=HISTORY):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(metrics, history, budget, host=None):
+    """List of regressions against the absolute limits and recent history.
+
+    Only runs recorded on ``host`` (all runs if None) are used as reference.
+    """
+    tolerance = budget.get("regression_tolerance", 0.5)
+    runs = [run for run in history if host is None or run.get("host") == host]
+    window = runs[-budget.get("history_window", 5):]
+    failures = []
+    for key, value in metrics.items():
+        higher_is_better = key.endswith("_per_s")
+        limit = budget.get("limits", {}).get(key)
+        if limit is not None and (value < limit if higher_is_better else value > limit):
+            failures.append(f"{key}: {value:.4g} beyond limit {limit:.4g}")
+        past = [run["metrics"][key] for run in window if key in run.get("metrics", {})]
+        if past:
+            reference = statistics.median(past)
+            if higher_is_better and value < reference / (1 + tolerance):
+                failures.append(f"{key}: {value:.4g} vs {reference:.4g} recently (-{(1 - value / reference) * 100:.0f}%)")
+            elif not higher_is_better and value > reference * (1 + tolerance):
+                failures.append(f"{key}: {value:.4g} vs {reference:.4g} recently (+{(value / reference - 1) * 100:.0f}%)")
+    return failures
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    import streamlit
+
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "host": platform.node(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "streamlit": streamlit.__version__,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the IBTR benchmarks and check for regressions.")
+    parser.add_argument("--quick", action="store_true", help="fewer repeats, batches up to 1e6, no app runs")
+    parser.add_argument("--record", action="store_true", help="append this run to benchmarks/history.jsonl")
+    parser.add_argument("--no-app", action="store_true", help="skip the startup and app-testing benchmarks")
+    parser.add_argument("--history", default=HISTORY)
+    args = parser.parse_args(argv)
+
+    with open(BUDGETS) as f:
+        budget = json.load(f)["benchmarks"]
+    if args.quick:
+        metrics = micro(sizes=[n for n in BATCH_SIZES if n <= CHUNK], repeats=3)
+    else:
+        metrics = micro()
+    if not (args.quick or args.no_app):
+        metrics.update(startup())
+        metrics.update(app_runs())
+
+    env = environment()
+    failures = compare(metrics, read_history(args.history), budget, env["host"])
+    for key, value in metrics.items():
+        unit = f"{value:12,.0f} /s" if key.endswith("_per_s") else (
+            f"{value:12.1f} ns" if key.endswith("_ns_per_key") else f"{value * 1000:12.3f} ms")
+        print(f"{key:34s}{unit}")
+    for failure in failures:
+        print(f"REGRESSION: {failure}")
+    if args.record:
+        with open(args.history, "a", encoding="utf-8") as f:
+            f.write(json.dumps({**env, "quick": args.quick, "metrics": metrics,
+                                "regressions": failures}) + "\n")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+## benchmarks/load_test.py - Concurrent-session load generator for the web app
+"""Simulate many concurrent clinic sessions of ``ibtr_app_en.py``.
+
+Sessions are driven through Streamlit's headless app-testing harness.  A
+session opens the page, picks a random language and then performs
+``--actions`` random actions (change a radio, toggle a checkbox, press
+Calculate) with exponentially distributed think times around ``--think``
+seconds.  Like a Streamlit server process, a worker process runs one
+script at a time; an action's latency is measured from the moment it is
+due, so time spent waiting behind other sessions' reruns is included and
+the saturation point shows up as growing tail latency.  ``--processes``
+splits the sessions over that many worker processes (server replicas).
+
+Reported per configuration: reruns per second, p50/p95/p99 latency (all
+reruns and Calculate presses) and the resident memory added per session.
+Configurations are the product of ``--processes`` and ``--cache`` (on = the
+default result cache, off = ``IBTR_CACHE_SIZE=0``); each runs in fresh
+worker processes.
+
+    python benchmarks/load_test.py --sessions 200 --actions 10 --think 5 --processes 1 2 4 --cache on off
+"""
+import argparse
+import heapq
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+APP = os.path.join(ROOT, "ibtr_app_en.py")
+LANGUAGES = ["English", "日本語"]
+# 操作の種類と選ばれる確率
+ACTIONS = [("radio", 0.3), ("checkbox", 0.3), ("calculate", 0.4)]
+
+
+def rss_bytes():
+    """Current resident set size of this process."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def perform(at, kind, rng):
+    if kind == "radio":
+        radio = rng.choice(list(at.radio))
+        radio.set_value(rng.choice(radio.options)).run()
+    elif kind == "checkbox":
+        checkbox = rng.choice(list(at.checkbox))
+        (checkbox.uncheck() if checkbox.value else checkbox.check()).run()
+    else:
+        at.button[0].click().run()
+
+
+def run_sessions(sessions, actions, think, seed):
+    """Drive ``sessions`` sessions in this process; returns raw measurements."""
+    sys.path.insert(0, ROOT)
+    from streamlit.testing.v1 import AppTest
+
+    AppTest.from_file(APP, default_timeout=60).run()  # 初回の import を計測から除く
+    rss_before = rss_bytes()
+    rng = random.Random(seed)
+    kinds, weights = zip(*ACTIONS)
+    apps = [None] * sessions
+    latencies = {"load": [], **{kind: [] for kind in kinds}}
+    errors = 0
+    start = time.perf_counter()
+    # (予定時刻, セッション, 手順) — 開始は think 時間の範囲にばらけさせる
+    queue = [(start + rng.uniform(0, think), i, 0) for i in range(sessions)]
+    heapq.heapify(queue)
+    while queue:
+        due, i, step = heapq.heappop(queue)
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        try:
+            if step == 0:
+                kind = "load"
+                apps[i] = AppTest.from_file(APP, default_timeout=60).run()
+                apps[i].selectbox[0].set_value(rng.choice(LANGUAGES)).run()
+            else:
+                kind = rng.choices(kinds, weights)[0]
+                perform(apps[i], kind, rng)
+            if apps[i].exception:
+                errors += 1
+        except Exception:
+            errors += 1
+        now = time.perf_counter()
+        latencies[kind].append(now - due)
+        if step < actions:
+            heapq.heappush(queue, (now + rng.expovariate(1 / think), i, step + 1))
+    wall = time.perf_counter() - start
+    return {
+        "sessions": sessions,
+        "wall_s": wall,
+        "latencies": latencies,
+        "errors": errors,
+        "rss_per_session": (rss_bytes() - rss_before) / max(sessions, 1),
+    }
+
+
+def run_config(sessions, actions, think, processes, cache, seed):
+    """Run one configuration in ``processes`` fresh worker processes."""
+    env = dict(os.environ)
+    if cache == "off":
+        env["IBTR_CACHE_SIZE"] = "0"
+    shares = [sessions // processes + (p < sessions % processes) for p in range(processes)]
+    workers = [
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--worker", "--sessions", str(n),
+             "--actions", str(actions), "--think", str(think), "--seed", str(seed + p)],
+            cwd=ROOT, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+        )
+        for p, n in enumerate(shares) if n
+    ]
+    results = []
+    for worker in workers:
+        out, _ = worker.communicate()
+        if worker.returncode:
+            raise RuntimeError(f"load worker exited with status {worker.returncode}")
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    return summarise(results, processes=processes, cache=cache)
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    q = statistics.quantiles(values, n=100, method="inclusive") if len(values) > 1 else [values[0]] * 99
+    return {"p50": q[49], "p95": q[94], "p99": q[98]}
+
+
+def summarise(results, **config):
+    every = [v for r in results for kind, values in r["latencies"].items() if kind != "load" for v in values]
+    calculate = [v for r in results for v in r["latencies"]["calculate"]]
+    loads = sum(len(r["latencies"]["load"]) for r in results)
+    wall = max(r["wall_s"] for r in results)
+    return {
+        **config,
+        "sessions": sum(r["sessions"] for r in results),
+        "reruns": len(every) + loads,
+        "throughput_per_s": (len(every) + loads) / wall,
+        "wall_s": wall,
+        "errors": sum(r["errors"] for r in results),
+        "latency": percentiles(every),
+        "calculate_latency": percentiles(calculate),
+        "rss_per_session_mb": statistics.mean(r["rss_per_session"] for r in results) / 2**20,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test ibtr_app_en.py with simulated concurrent sessions.")
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--actions", type=int, default=10, help="actions per session after opening the page")
+    parser.add_argument("--think", type=float, default=5.0, help="mean think time between actions (s)")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1], help="worker process counts to compare")
+    parser.add_argument("--cache", nargs="+", choices=["on", "off"], default=["on"])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(run_sessions(args.sessions, args.actions, args.think, args.seed)))
+        return
+
+    results = []
+    print(f"{'processes':>9} {'cache':>5} {'reruns/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'calc p95':>8} {'MB/sess':>8} {'errors':>6}")
+    for processes in args.processes:
+        for cache in args.cache:
+            r = run_config(args.sessions, args.actions, args.think, processes, cache, args.seed)
+            results.append(r)
+            print(f"{processes:>9} {cache:>5} {r['throughput_per_s']:>9.1f} {r['latency']['p50'] * 1000:>8.0f} "
+                  f"{r['latency']['p95'] * 1000:>8.0f} {r['latency']['p99'] * 1000:>8.0f} "
+                  f"{r['calculate_latency']['p95'] * 1000:>8.0f} {r['rss_per_session_mb']:>8.2f} {r['errors']:>6}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+## benchmarks/startup_budget.py - Cold start budget of the web app, checked offline
+"""Measure the cold start of ``ibtr_app_en.py`` and check it against budgets.
+
+Every repeat runs in a fresh interpreter, so nothing is warm in
+``sys.modules``.  Measured are the import of streamlit, the import of the
+app's own modules, and the first full script run (first paint) through
+Streamlit's headless app-testing harness.  The first run must not import any
+module listed in ``forbidden_on_first_run``.
+
+    python benchmarks/startup_budget.py            # exit status 1 if over budget
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGETS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "budgets.json")
+
+PROBE = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import streamlit
+from streamlit.testing.v1 import AppTest
+t1 = time.perf_counter()
+import ibtr_text, ibtr_cache, ibtr_model, ibtr_table
+t2 = time.perf_counter()
+before = set(sys.modules)
+at = AppTest.from_file("ibtr_app_en.py", default_timeout=60).run()
+t3 = time.perf_counter()
+assert not at.exception, at.exception
+print(json.dumps({
+    "streamlit_import_s": t1 - t0,
+    "app_modules_import_s": t2 - t1,
+    "first_run_s": t3 - t2,
+    "imported_on_first_run": sorted(set(sys.modules) - before),
+}))
+"""
+
+
+def measure(repeats=5):
+    """Median timings over ``repeats`` fresh interpreters."""
+    runs = []
+    for _ in range(repeats):
+        out = subprocess.run(
+            [sys.executable, "-c", PROBE], cwd=ROOT, check=True, capture_output=True, text=True
+        )
+        runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    result = {
+        key: statistics.median(run[key] for run in runs)
+        for key in ("streamlit_import_s", "app_modules_import_s", "first_run_s")
+    }
+    result["imported_on_first_run"] = sorted(set().union(*(run["imported_on_first_run"] for run in runs)))
+    return result
+
+
+def check(result, budget):
+    """List of budget violations (empty if within budget)."""
+    failures = []
+    for key, limit in budget.items():
+        if key.endswith("_s") and result[key] > limit:
+            failures.append(f"{key}: {result[key]:.3f}s > {limit:.3f}s")
+    for module in budget.get("forbidden_on_first_run", []):
+        if module in result["imported_on_first_run"]:
+            failures.append(f"{module} imported on first run")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the app's cold start against benchmarks/budgets.json.")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    with open(BUDGETS) as f:
+        budget = json.load(f)["startup"]
+    result = measure(args.repeats)
+    for key in ("streamlit_import_s", "app_modules_import_s", "first_run_s"):
+        print(f"{key:22s} {result[key] * 1000:8.1f} ms   (budget {budget[key] * 1000:.0f} ms)")
+    failures = check(result, budget)
+    for failure in failures:
+        print(f"OVER BUDGET: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+## ibtr_batch.py - Streaming batch scoring of registry files (CSV / Parquet)
+"""Score CSV or Parquet patient files in fixed-size chunks.
+
+Input columns are ``age``, ``margin``, ``t_stage`` and ``grade`` (English or
+Japanese display labels as used in the app, variable names, or integer codes)
+and the 0/1 columns ``lvi``, ``hormone_receptor``, ``her2``, ``radiation``,
+``chemotherapy``, ``endocrine`` and ``targeted`` (missing flag columns are
+taken as 0).  Each output chunk is the input chunk with ``xb``, ``se_total``,
+``risk_<h>``/``lower_<h>``/``upper_<h>`` for every horizon and
+``model_version`` appended, and is written before the next chunk is read, so
+peak memory is bounded by the chunk size (times the number of chunks in
+flight with ``--workers``).  With ``--contributions`` the float32
+contribution of every non-reference variable (``contrib_<h>_<variable>``,
+see ``ibtr_contribution``) is appended as well.
+
+Chunks are Arrow record batches end to end.  The engine writes its outputs
+into one preallocated float64 block (``ibtr_model.score_into``) whose rows
+become the Arrow columns without a copy, and Parquet and CSV writers and
+``to_pandas`` consume them as they are.  Categorical label columns are read
+(Parquet) or kept (CSV) dictionary-encoded, so a label is stored once per
+chunk rather than once per row, and ``model_version`` is a one-entry
+dictionary column.
+
+    python ibtr_batch.py registry.parquet scored.parquet --chunksize 500000 --workers 4
+"""
+import argparse
+import functools
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from ibtr_model import CATEGORICAL, DEFAULT_MODEL, FLAGS, category_codes, design_matrix, output_columns, score_into
+
+
+def file_format(path, fmt=None):
+    if fmt:
+        return fmt
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".parquet", ".pq"):
+        return "parquet"
+    if ext in (".csv", ".txt", ".gz"):
+        return "csv"
+    raise ValueError(f"{path}: cannot infer file format, use --input-format/--output-format")
+
+
+def read_chunks(path, chunksize, fmt=None):
+    """Yield DataFrames of at most ``chunksize`` rows."""
+    if file_format(path, fmt) == "parquet":
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunksize)
+
+
+def read_batches(path, chunksize, fmt=None):
+    """Yield Arrow record batches of at most ``chunksize`` rows.
+
+    Categorical label columns of Parquet files are read dictionary-encoded.
+    """
+    if file_format(path, fmt) == "parquet":
+        import pyarrow.parquet as pq
+
+        schema = pq.read_schema(path)
+        labels = [column for column in CATEGORICAL
+                  if column in schema.names and pa.types.is_string(schema.field(column).type)]
+        yield from pq.ParquetFile(path, read_dictionary=labels).iter_batches(batch_size=chunksize)
+    else:
+        for frame in pd.read_csv(path, chunksize=chunksize):
+            yield pa.RecordBatch.from_pandas(frame, preserve_index=False)
+
+
+def encode_categoricals(batch):
+    """Dictionary-encode the categorical label columns (string) of a record batch."""
+    arrays = [
+        pc.dictionary_encode(array) if name in CATEGORICAL and pa.types.is_string(array.type) else array
+        for name, array in zip(batch.schema.names, batch.columns)
+    ]
+    return pa.RecordBatch.from_arrays(arrays, names=batch.schema.names)
+
+
+def arrow_codes(array, column):
+    """Level codes of a categorical Arrow column (labels, dictionary or integer codes)."""
+    if array.null_count:
+        raise ValueError(f"{column}: missing value(s)")
+    if pa.types.is_dictionary(array.type):
+        # 辞書の値を一度だけ変換し、インデックスで全行に展開
+        codes = category_codes(array.dictionary.to_numpy(zero_copy_only=False), column)
+        return codes[array.indices.to_numpy()]
+    return category_codes(array.to_numpy(zero_copy_only=False), column)
+
+
+def score_batch(batch, contributions=False, model=DEFAULT_MODEL):
+    """Score one record batch: its input columns followed by the model outputs.
+
+    Output columns wrap the buffers written by ``score_into`` without a copy;
+    input columns of the same names are replaced.  Flags must be 0/1 without
+    missing values, and endocrine / anti-HER2 therapy require HR+ / HER2+,
+    as for the risk table and the scoring service (ValueError otherwise).
+    """
+    missing = [column for column in CATEGORICAL if column not in batch.schema.names]
+    if missing:
+        raise ValueError(f"missing input column(s): {missing}")
+    batch = encode_categoricals(batch)
+    columns = {column: arrow_codes(batch.column(column), column) for column in CATEGORICAL}
+    for flag in FLAGS:
+        if flag in batch.schema.names:
+            # 検証（0/1、欠損、治療の組み合わせ）は score_into で行う
+            columns[flag] = batch.column(flag).to_numpy(zero_copy_only=False)
+    out = score_into(columns, model=model)
+
+    replaced = set(output_columns(model)) | {"model_version"}
+    names = [name for name in batch.schema.names if name not in replaced]
+    arrays = [batch.column(name) for name in names]
+    for name, values in out.items():
+        names.append(name)
+        arrays.append(pa.array(values))
+    names.append("model_version")
+    arrays.append(pa.DictionaryArray.from_arrays(np.zeros(batch.num_rows, dtype=np.int8), [model.version]))
+    if contributions:
+        from ibtr_contribution import contribution_columns, contributions as contribution_of
+
+        for name, values in contribution_columns(contribution_of(design_matrix(columns), model), model).items():
+            names.append(name)
+            arrays.append(pa.array(values))
+    return pa.RecordBatch.from_arrays(arrays, names=names)
+
+
+def to_pandas(batch):
+    """DataFrame view of a scored batch; float columns share the Arrow buffers."""
+    return batch.to_pandas(split_blocks=True)
+
+
+def score_chunk(frame, contributions=False, model=DEFAULT_MODEL):
+    """Append the model outputs (and optionally the contributions) to one DataFrame chunk."""
+    batch = score_batch(pa.RecordBatch.from_pandas(frame, preserve_index=False), contributions, model)
+    return to_pandas(batch).set_axis(frame.index)
+
+
+def _in_order(score_one, chunks, workers):
+    if workers <= 1:
+        for chunk in chunks:
+            yield score_one(chunk)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = []
+        for chunk in chunks:
+            pending.append(pool.submit(score_one, chunk))
+            if len(pending) >= 2 * workers:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+
+def scored_chunks(chunks, workers=1, contributions=False, model=DEFAULT_MODEL):
+    """Score DataFrame chunks in order, optionally spread over a process pool.
+
+    At most ``2 * workers`` chunks are in flight at any time.
+    """
+    return _in_order(functools.partial(score_chunk, contributions=contributions, model=model), chunks, workers)
+
+
+def scored_batches(batches, workers=1, contributions=False, model=DEFAULT_MODEL):
+    """Record-batch counterpart of ``scored_chunks``."""
+    return _in_order(functools.partial(score_batch, contributions=contributions, model=model), batches, workers)
+
+
+class ChunkWriter:
+    """Append scored chunks (record batches or DataFrames) to a CSV or Parquet file.
+
+    The schema is fixed by the first chunk; later chunks are cast to it.
+    CSV files ending in ``.gz`` are gzip-compressed.
+    """
+
+    def __init__(self, path, fmt=None):
+        self.path = path
+        self.format = file_format(path, fmt)
+        self.schema = None
+        self._writer = None
+        self._sink = None
+
+    def _open_sink(self):
+        if self.path.lower().endswith(".gz"):
+            self._sink = pa.CompressedOutputStream(self.path, "gzip")
+        else:
+            self._sink = pa.OSFile(self.path, "wb")
+        return self._sink
+
+    def write(self, batch):
+        if isinstance(batch, pd.DataFrame):
+            batch = pa.RecordBatch.from_pandas(batch, preserve_index=False)
+        if self._writer is None:
+            self.schema = batch.schema
+            if self.format == "parquet":
+                import pyarrow.parquet as pq
+
+                self._writer = pq.ParquetWriter(self.path, batch.schema)
+            else:
+                import pyarrow.csv as pacsv
+
+                self._writer = pacsv.CSVWriter(self._open_sink(), batch.schema,
+                                               write_options=pacsv.WriteOptions(quoting_style="needed"))
+        elif not batch.schema.equals(self.schema):
+            batch = pa.Table.from_batches([batch]).cast(self.schema)
+        self._writer.write(batch)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        elif self.format == "csv":
+            self._open_sink()
+        if self._sink is not None:
+            self._sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a registry file with the IBTR model, chunk by chunk.")
+    parser.add_argument("input", help="CSV or Parquet patient file")
+    parser.add_argument("output", help="CSV or Parquet file to write")
+    parser.add_argument("--chunksize", type=int, default=100_000, help="rows per chunk (default: 100000)")
+    parser.add_argument("--workers", type=int, default=1, help="processes to spread chunks over (default: 1)")
+    parser.add_argument("--input-format", choices=["csv", "parquet"])
+    parser.add_argument("--output-format", choices=["csv", "parquet"])
+    parser.add_argument("--contributions", action="store_true",
+                        help="append the per-variable risk contributions (float32)")
+    parser.add_argument("--version", help="model version (default: the served version)")
+    args = parser.parse_args(argv)
+
+    from ibtr_registry import current_model, default_registry
+
+    model = default_registry().get(args.version) if args.version else current_model()
+    rows = 0
+    with ChunkWriter(args.output, args.output_format) as writer:
+        batches = read_batches(args.input, args.chunksize, args.input_format)
+        for batch in scored_batches(batches, args.workers, args.contributions, model):
+            writer.write(batch)
+            rows += batch.num_rows
+    print(f"{args.output}: {rows} rows scored with model v{model.version}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
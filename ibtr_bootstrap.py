@@ -0,0 +1,260 @@
+## ibtr_bootstrap.py - Parallel cohort bootstrap over shared memory
+"""Bootstrap confidence intervals for cohort-level summaries.
+
+The cohort is encoded once as the ``ibtr_table`` key of every patient (the
+mixed-radix encoding of the design matrix) plus its follow-up time and IBTR
+indicator, sorted by time, and placed in ``multiprocessing.shared_memory``.
+Workers attach to the blocks when they start; a task carries only a
+``SeedSequence`` and a replicate count and returns a small array, so the
+cohort is never pickled per replicate.
+
+Each replicate resamples patients with replacement and computes, per
+horizon, the mean predicted IBTR risk, the Kaplan–Meier observed risk and
+O/E, and optionally Harrell's C of ``xb``.  With weights from
+``np.bincount`` of the resampled indices the Kaplan–Meier step is a
+weighted cumulative sum over the pre-sorted times, O(n) per replicate.
+With ``cov`` every replicate also draws the model parameters (see
+``ibtr_uncertainty``), so the intervals include parameter uncertainty.
+
+Replicates are split into blocks of ``BLOCK`` with one child
+``SeedSequence`` per block, so results for a seed do not depend on the
+number of workers.
+
+    python ibtr_bootstrap.py cohort.csv --replicates 2000 --workers 8 --time followup_years --event ibtr
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from ibtr_model import DEFAULT_MODEL, N_VARIABLES, horizon_years
+from ibtr_table import TABLE_SIZE, enumerate_design, model_table
+from ibtr_uncertainty import _risks, draw_parameters
+from ibtr_validation import event_indicator, harrell_c
+
+BLOCK = 25
+
+# ワーカー内の状態（initializer で設定）
+_STATE = {}
+
+
+def statistic_names(model=DEFAULT_MODEL, outcomes=True, c_index=False):
+    names = []
+    for year in model.baseline_survival:
+        names.append(f"mean_risk_{year}")
+        if outcomes:
+            names += [f"observed_{year}", f"oe_{year}"]
+    if outcomes and c_index:
+        names.append("c_index")
+    return names
+
+
+def _prepare(keys, time=None, event=None):
+    """Cohort arrays in the shared layout: sorted by time, keys as int16."""
+    keys = np.asarray(keys, dtype=np.int16)
+    if time is None:
+        return {"keys": keys}
+    time = np.asarray(time, dtype=float)
+    order = np.argsort(time, kind="stable")
+    time = time[order]
+    times, time_index = np.unique(time, return_inverse=True)
+    return {
+        "keys": keys[order],
+        "time": time,
+        "event": event_indicator(event)[order],
+        "time_index": time_index.astype(np.int32),
+        "times": times,
+    }
+
+
+def _set_state(arrays, model, cov, c_index):
+    table = model_table(model)
+    _STATE.update(
+        arrays=arrays,
+        model=model,
+        cov=cov,
+        c_index=c_index,
+        risk=table.values[..., 0],
+        xb=enumerate_design() @ model.log_hr if cov is None else None,
+        design=enumerate_design() if cov is not None else None,
+        horizons=[horizon_years(year) for year in model.baseline_survival],
+    )
+
+
+def _attach(spec, model, cov, c_index):
+    """Pool initializer: map the shared blocks into this worker."""
+    arrays = {}
+    blocks = []
+    for name, (shm_name, dtype, shape) in spec.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        blocks.append(shm)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    _STATE["blocks"] = blocks
+    _set_state(arrays, model, cov, c_index)
+
+
+def _km_risk(counts, tau_index):
+    """Weighted Kaplan–Meier risk at each horizon from resampling counts."""
+    a = _STATE["arrays"]
+    n_times = len(a["times"])
+    at_time = np.bincount(a["time_index"], weights=counts, minlength=n_times)
+    events = np.bincount(a["time_index"], weights=counts * a["event"], minlength=n_times)
+    at_risk = counts.sum() - np.concatenate([[0.0], np.cumsum(at_time)[:-1]])
+    hazard = np.divide(events, at_risk, out=np.zeros(n_times), where=at_risk > 0)
+    S = np.cumprod(1 - hazard)
+    return [1 - S[i] if i >= 0 else 0.0 for i in tau_index]
+
+
+def _replicates(seed, n_reps):
+    """Statistics of ``n_reps`` replicates, one row each."""
+    a = _STATE["arrays"]
+    model, cov = _STATE["model"], _STATE["cov"]
+    keys = a["keys"]
+    n = len(keys)
+    outcomes = "time" in a
+    rng = np.random.default_rng(seed)
+    if outcomes:
+        tau_index = np.searchsorted(a["times"], _STATE["horizons"], side="right") - 1
+    theta = draw_parameters(cov, model, n_reps, rng) if cov is not None else None
+    rows = []
+    for r in range(n_reps):
+        idx = rng.integers(0, n, size=n)
+        counts = np.bincount(idx, minlength=n).astype(float)
+        key_counts = np.bincount(keys, weights=counts, minlength=TABLE_SIZE)
+        if theta is None:
+            risk, xb = _STATE["risk"], _STATE["xb"]
+        else:
+            xb = _STATE["design"] @ theta[r, :N_VARIABLES]
+            risk = _risks(xb[:, None] + theta[r, N_VARIABLES:][None, :])
+        mean_risk = key_counts @ risk / n
+        row = []
+        if outcomes:
+            observed = _km_risk(counts, tau_index)
+            for j in range(len(mean_risk)):
+                row += [mean_risk[j], observed[j], observed[j] / mean_risk[j]]
+            if _STATE["c_index"]:
+                idx.sort()
+                row.append(harrell_c(a["time"][idx], a["event"][idx], xb[keys[idx]]))
+        else:
+            row += list(mean_risk)
+        rows.append(row)
+    return np.array(rows)
+
+
+def _point_estimate():
+    """Statistics of the original cohort (all counts 1, point parameters)."""
+    a = _STATE["arrays"]
+    keys = a["keys"]
+    n = len(keys)
+    risk, xb = _STATE["risk"], enumerate_design() @ _STATE["model"].log_hr
+    mean_risk = np.bincount(keys, minlength=TABLE_SIZE) @ risk / n
+    if "time" not in a:
+        return np.asarray(mean_risk)
+    tau_index = np.searchsorted(a["times"], _STATE["horizons"], side="right") - 1
+    observed = _km_risk(np.ones(n), tau_index)
+    row = []
+    for j in range(len(mean_risk)):
+        row += [mean_risk[j], observed[j], observed[j] / mean_risk[j]]
+    if _STATE["c_index"]:
+        row.append(harrell_c(a["time"], a["event"], xb[keys]))
+    return np.array(row)
+
+
+def bootstrap(keys, time=None, event=None, replicates=1000, workers=None, seed=None,
+              model=DEFAULT_MODEL, cov=None, c_index=False, level=0.95):
+    """Bootstrap the cohort summaries.
+
+    ``keys`` are ``ibtr_table.patient_keys`` of the cohort; without
+    ``time``/``event`` only the mean predicted risks are bootstrapped.
+    Returns ``names``, ``estimate`` (original cohort), ``replicates``
+    (R × statistics) and per statistic ``se``, ``lower`` and ``upper``
+    (percentile interval).
+    """
+    workers = workers or os.cpu_count() or 1
+    arrays = _prepare(keys, time, event)
+    children = np.random.SeedSequence(seed).spawn(-(-replicates // BLOCK))
+    sizes = [min(BLOCK, replicates - i * BLOCK) for i in range(len(children))]
+
+    if workers <= 1:
+        _set_state(arrays, model, cov, c_index)
+        results = [_replicates(child, size) for child, size in zip(children, sizes)]
+    else:
+        blocks = []
+        try:
+            spec = {}
+            for name, array in arrays.items():
+                shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                blocks.append(shm)
+                np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+                spec[name] = (shm.name, array.dtype, array.shape)
+            with ProcessPoolExecutor(workers, initializer=_attach, initargs=(spec, model, cov, c_index)) as pool:
+                results = list(pool.map(_replicates, children, sizes))
+        finally:
+            for shm in blocks:
+                shm.close()
+                shm.unlink()
+        _set_state(arrays, model, cov, c_index)
+
+    draws = np.concatenate(results)
+    alpha = (1 - level) / 2
+    lower, upper = np.nanquantile(draws, [alpha, 1 - alpha], axis=0)
+    return {
+        "names": statistic_names(model, time is not None, c_index),
+        "estimate": _point_estimate(),
+        "replicates": draws,
+        "se": np.nanstd(draws, axis=0, ddof=1),
+        "lower": lower,
+        "upper": upper,
+    }
+
+
+def main(argv=None):
+    import time as clock
+
+    from ibtr_batch import read_chunks
+    from ibtr_registry import current_model, default_registry
+    from ibtr_table import patient_keys
+
+    parser = argparse.ArgumentParser(description="Bootstrap cohort-level IBTR summaries in parallel.")
+    parser.add_argument("input", help="CSV or Parquet cohort file")
+    parser.add_argument("--time", help="follow-up column in years (enables observed risk, O/E and C)")
+    parser.add_argument("--event", default="event", help="IBTR indicator column (default: event)")
+    parser.add_argument("--replicates", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--c-index", action="store_true", help="also bootstrap Harrell's C (O(n log n) per replicate)")
+    parser.add_argument("--covariance", help="draw the model parameters from this covariance (.npy or .csv)")
+    parser.add_argument("--version", help="model version (default: the served version)")
+    parser.add_argument("--chunksize", type=int, default=100_000)
+    args = parser.parse_args(argv)
+
+    model = default_registry().get(args.version) if args.version else current_model()
+    cov = None
+    if args.covariance:
+        from ibtr_uncertainty import load_covariance
+
+        cov = load_covariance(args.covariance, model)
+    keys, time, event = [], [], []
+    for frame in read_chunks(args.input, args.chunksize):
+        keys.append(patient_keys(frame))
+        if args.time:
+            time.append(frame[args.time].to_numpy(dtype=float))
+            event.append(event_indicator(frame[args.event].to_numpy(), args.event))
+    keys = np.concatenate(keys)
+    time = np.concatenate(time) if args.time else None
+    event = np.concatenate(event) if args.time else None
+
+    start = clock.perf_counter()
+    result = bootstrap(keys, time, event, args.replicates, args.workers, args.seed, model, cov, args.c_index)
+    elapsed = clock.perf_counter() - start
+    print(f"model v{model.version}: n={len(keys)}, {args.replicates} replicates on {args.workers} "
+          f"worker(s) in {elapsed:.1f} s")
+    for i, name in enumerate(result["names"]):
+        print(f"{name}: {result['estimate'][i]:.4f} (SE {result['se'][i]:.4f}, "
+              f"95% CI {result['lower'][i]:.4f}-{result['upper'][i]:.4f})")
+
+
+if __name__ == "__main__":
+    main()
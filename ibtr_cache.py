@@ -0,0 +1,68 @@
+## ibtr_cache.py - Process-wide LRU cache of computed results shared by all sessions
+"""Bounded LRU cache shared by every Streamlit session of one server process.
+
+Entries are keyed by ``(model_version, fingerprint, patient_key)`` (the
+fingerprint of the model's risk table, so a version republished with other
+coefficients gets new entries) and hold the ``results`` dict and the
+serialized Plotly figure specs of one covariate profile.  Values are shared between sessions, so callers must not mutate
+them.  The size bound is read from ``$IBTR_CACHE_SIZE`` (default 1024,
+0 disables caching).
+"""
+import functools
+import os
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAXSIZE = 1024
+
+
+class ResultCache:
+    """Thread-safe LRU mapping with hit/miss/eviction counters."""
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        """Return the cached value for ``key``, calling ``compute()`` on a miss."""
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+        value = compute()
+        if self.maxsize > 0:
+            with self._lock:
+                self._data[key] = value
+                self._data.move_to_end(key)
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+@functools.lru_cache(maxsize=None)
+def default_cache():
+    """The process-wide cache, sized from ``$IBTR_CACHE_SIZE``."""
+    return ResultCache(int(os.environ.get("IBTR_CACHE_SIZE", DEFAULT_MAXSIZE)))
@@ -0,0 +1,288 @@
+## ibtr_metrics.py - Low-overhead timing spans, counters and exporters for the web app
+"""Runtime instrumentation of ``ibtr_app_en.py``.
+
+``span(stage)`` times a block into a per-stage histogram and counts the
+exceptions raised in it; ``inc(name)`` bumps a counter.  Both cost about a
+microsecond, so they are always on.  A rerun is bracketed by
+``begin_rerun``/``end_rerun`` to collect its span durations for the log.
+
+Exporters are opt-in through the environment and started once per process
+by ``setup()``:
+
+* ``IBTR_METRICS_PORT``: Prometheus text format at
+  ``http://127.0.0.1:<port>/metrics`` (and ``/profile`` when profiling);
+* ``IBTR_METRICS_LOG``: one JSON line per rerun, rotated at 10 MB;
+* ``IBTR_PROFILE``: sampling profiler with an interval in milliseconds;
+  the folded stacks (flame graph input) are served at ``/profile`` and
+  written to ``$IBTR_PROFILE_OUT`` (default ``ibtr_profile.folded``) at exit.
+
+Only stage names, durations, counts, the display language and code
+locations are recorded — never patient characteristics, treatments,
+results or cache keys, in line with the app's privacy policy.
+"""
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+PREFIX = "ibtr"
+
+
+class Metrics:
+    """Thread-safe counters and per-stage duration histograms."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counters = Counter()
+        self.histograms = {}
+        self.collectors = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._log = None
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] += amount
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            h = self.histograms.get(stage)
+            if h is None:
+                h = self.histograms[stage] = {"buckets": [0] * len(self.buckets), "count": 0, "sum": 0.0}
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    h["buckets"][i] += 1
+                    break
+            h["count"] += 1
+            h["sum"] += seconds
+        record = getattr(self._local, "record", None)
+        if record is not None:
+            record["spans_ms"][stage] = record["spans_ms"].get(stage, 0.0) + seconds * 1000
+
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            # Streamlit の rerun/stop は例外で制御を戻すので、エラーとしては数えない
+            if type(e).__name__ not in ("RerunException", "StopException"):
+                self.inc("errors_total", stage=stage)
+                record = getattr(self._local, "record", None)
+                if record is not None:
+                    record["error"] = stage
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def begin_rerun(self, kind, outermost=False, **fields):
+        """Start collecting the spans of one rerun on this thread.
+
+        Returns False, and collects nothing new, when a rerun is already
+        being collected (e.g. a fragment inside a full script run) unless
+        ``outermost`` is set, which discards any unfinished record.
+        """
+        if not outermost and getattr(self._local, "record", None) is not None:
+            return False
+        self.inc("reruns_total", kind=kind)
+        self._local.record = {"kind": kind, **fields, "spans_ms": {}, "error": None,
+                              "start": time.perf_counter()}
+        return True
+
+    def end_rerun(self, **fields):
+        """Finish the rerun of this thread and write it to the log, if enabled."""
+        record = getattr(self._local, "record", None)
+        self._local.record = None
+        if record is None:
+            return None
+        total = time.perf_counter() - record.pop("start")
+        self.observe(f"rerun_{record['kind']}", total)
+        record.update(fields, total_ms=total * 1000, ts=time.time())
+        if self._log is not None:
+            self._log.info(json.dumps(record, ensure_ascii=False))
+        return record
+
+    def collector(self, fn=None, kind="gauge"):
+        """Register ``fn() -> {name: value}``, exported as ``kind`` at scrape time.
+
+        Use ``kind="counter"`` for values that only increase (names ending in
+        ``_total``).  Usable as ``@metrics.collector`` or
+        ``@metrics.collector(kind="counter")``.
+        """
+        if fn is None:
+            return functools.partial(self.collector, kind=kind)
+        self.collectors.append((fn, kind))
+        return fn
+
+    def prometheus(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {stage: {"buckets": list(h["buckets"]), "count": h["count"], "sum": h["sum"]}
+                          for stage, h in self.histograms.items()}
+        seen = set()
+        for (name, labels), value in sorted(counters.items()):
+            if name not in seen:
+                lines.append(f"# TYPE {PREFIX}_{name} counter")
+                seen.add(name)
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+            lines.append(f"{PREFIX}_{name}{{{label_text}}} {value}" if labels else f"{PREFIX}_{name} {value}")
+        if histograms:
+            lines.append(f"# TYPE {PREFIX}_stage_seconds histogram")
+        for stage, h in sorted(histograms.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, h["buckets"]):
+                cumulative += n
+                lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {h["count"]}')
+            lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {h["sum"]:.6f}')
+            lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {h["count"]}')
+        for fn, kind in self.collectors:
+            for name, value in fn().items():
+                lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+                lines.append(f"{PREFIX}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def open_log(self, path, max_bytes=10 * 2**20, backups=5):
+        """Write one JSON line per rerun to a size-rotated log file."""
+        import logging
+        from logging.handlers import RotatingFileHandler
+
+        logger = logging.getLogger(f"{PREFIX}.reruns")
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        self._log = logger
+
+
+class SamplingProfiler:
+    """Samples the stacks of all other threads every ``interval`` seconds.
+
+    Only file names, function names and line numbers are kept, as folded
+    stacks (``a.py:f:1;b.py:g:2 count``).
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.stacks = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                try:
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                        frame = frame.f_back
+                except AttributeError:
+                    continue  # 終了中のスレッドの frame は途中で壊れていることがある
+                with self._lock:
+                    self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="ibtr-profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def folded(self):
+        with self._lock:
+            return "".join(f"{stack} {n}\n" for stack, n in self.stacks.most_common())
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.folded())
+
+
+def start_http_server(port, metrics, profiler=None, host="127.0.0.1"):
+    """Serve ``/metrics`` (and ``/profile``) from a daemon thread."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, ctype = metrics.prometheus(), "text/plain; version=0.0.4"
+            elif self.path == "/profile" and profiler is not None:
+                body, ctype = profiler.folded(), "text/plain"
+            else:
+                self.send_error(404)
+                return
+            data = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", f"{ctype}; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="ibtr-metrics", daemon=True).start()
+    return server
+
+
+@functools.lru_cache(maxsize=None)
+def default_metrics():
+    return Metrics()
+
+
+@functools.lru_cache(maxsize=None)
+def setup():
+    """Start the exporters configured in the environment (once per process)."""
+    metrics = default_metrics()
+
+    # 累積値（hits/misses/evictions）は counter、現在値は gauge として出力
+    @metrics.collector(kind="counter")
+    def cache_counts():
+        from ibtr_cache import default_cache
+
+        stats = default_cache().stats()
+        return {f"cache_{key}_total": stats[key] for key in ("hits", "misses", "evictions")}
+
+    @metrics.collector
+    def cache_state():
+        from ibtr_cache import default_cache
+
+        stats = default_cache().stats()
+        return {f"cache_{key}": stats[key] for key in ("size", "maxsize", "hit_rate")}
+
+    profiler = None
+    if os.environ.get("IBTR_PROFILE"):
+        profiler = SamplingProfiler(float(os.environ["IBTR_PROFILE"]) / 1000).start()
+        atexit.register(profiler.dump, os.environ.get("IBTR_PROFILE_OUT", "ibtr_profile.folded"))
+    if os.environ.get("IBTR_METRICS_LOG"):
+        metrics.open_log(os.environ["IBTR_METRICS_LOG"])
+    if os.environ.get("IBTR_METRICS_PORT"):
+        try:
+            start_http_server(int(os.environ["IBTR_METRICS_PORT"]), metrics, profiler)
+        except OSError:
+            pass  # 他のプロセスが使用中
+    return metrics
+
+
+def span(stage):
+    return default_metrics().span(stage)
+
+
+def inc(name, amount=1, **labels):
+    default_metrics().inc(name, amount, **labels)
@@ -0,0 +1,412 @@
+## ibtr_model.py - Streamlit-free IBTR Cox model scoring engine (vectorized)
+"""IBTR Cox model scoring engine.
+
+The Streamlit pages and batch jobs share this module so that a single patient
+and a whole registry go through the same code path.  Patients are rows of an
+N×21 design matrix in the order of ``variables``; scoring is one
+matrix–vector product for the linear predictor and one broadcast over the
+follow-up times.
+
+The baseline is a table of the cumulative hazard H0(t) at follow-up times in
+years, interpolated linearly in between (constant hazard between knots).
+Without a tabulated hazard it is built from the 5y/10y baseline survival
+with H0(0) = 0, which gives exactly ``1 - S0 ** exp(xb)`` at the horizons.
+"""
+import functools
+from dataclasses import dataclass
+
+import numpy as np
+
+MODEL_VERSION = "1.61"
+
+# --- HR Model Coefficients  ---
+# 変数名, 表示名, log(HR), SE
+# 現行バージョンの係数の唯一の定義。models/v<MODEL_VERSION>/ は `python ibtr_registry.py build` で
+# ここから生成し、`python ibtr_registry.py check` で一致を確認する
+variables = [
+    ("agecategory_<40", "Under 40", 0.874573, 0.417364),
+    ("agecategory_40s", "40s", 0.0, 0.0),
+    ("agecategory_50s", "50s", -0.182361, 0.136322),
+    ("agecategory_60s", "60s", -0.267784, 0.132929),
+    ("agecategory_70+", "70 or older", -0.489379, 0.129613),
+    ("finalmargin_negative", "Negative margin", 0.0, 0.0),
+    ("finalmargin_close(<5mm)", "Close margin(<5mm)", 0.511362, 0.227433),
+    ("finalmargin_positive", "Positive margin", 0.861087, 0.456145),
+    ("pT_1", "pT1", 0.0, 0.0),
+    ("pT_2", "pT2", 0.134593, 0.170066),
+    ("pT_3", "pT3", 0.682241, 1.413398),
+    ("grade_1", "Grade 1", 0.0, 0.0),
+    ("grade_2", "Grade 2", 0.192654, 0.171228),
+    ("grade_3", "Grade 3", 0.413136, 0.297550),
+    ("lvi", "Lymphovascular invasion (LVI)", 0.415052, 0.201020),
+    ("hormone_receptor", "Hormone receptor positive", -0.107287, 0.213524),
+    ("her2", "HER2 positive", 0.383047, 0.408019),
+    ("radiation", "Received radiation therapy", -1.171182982, 0.04),
+    ("chemotherapy", "Received chemotherapy", -0.46203546, 0.08),
+    ("endocrine", "Received endocrine therapy", -0.616186139, 0.07),
+    ("targeted", "Received Anti-HER2 therapy", -0.195477, 0.264011),
+]
+
+baseline_survival = {"5y": 0.9425415, "10y": 0.8746572}
+
+VARIABLE_NAMES = [var for var, _, _, _ in variables]
+N_VARIABLES = len(variables)
+
+# マッピング用辞書を定義（英語・日本語の表示ラベル → 変数名）
+age_mapping = {
+    "Under 40": "agecategory_<40",
+    "40s": "agecategory_40s",
+    "50s": "agecategory_50s",
+    "60s": "agecategory_60s",
+    "70 or older": "agecategory_70+",
+    "40歳未満": "agecategory_<40",
+    "40代": "agecategory_40s",
+    "50代": "agecategory_50s",
+    "60代": "agecategory_60s",
+    "70歳以上": "agecategory_70+"
+}
+
+margin_mapping = {
+    "Clear (≥5mm)": "finalmargin_negative",
+    "Close (<5mm)": "finalmargin_close(<5mm)",
+    "Involved (tumor on ink)": "finalmargin_positive",
+    "陰性断端(≥5mm)": "finalmargin_negative",
+    "近接断端(<5mm)": "finalmargin_close(<5mm)",
+    "陽性断端（tumor on ink）": "finalmargin_positive"
+}
+
+t_stage_mapping = {
+    "pT1": "pT_1",
+    "pT2": "pT_2",
+    "pT3": "pT_3",
+    "pT3（極少数）": "pT_3",
+    "pT3 (very few cases)": "pT_3"
+}
+
+grade_mapping = {
+    "Grade 1": "grade_1",
+    "Grade 2": "grade_2",
+    "Grade 3": "grade_3"
+}
+
+# カテゴリ変数: 列名 → (ラベルの辞書, 水準の変数名)
+CATEGORICAL = {
+    "age": (age_mapping, VARIABLE_NAMES[0:5]),
+    "margin": (margin_mapping, VARIABLE_NAMES[5:8]),
+    "t_stage": (t_stage_mapping, VARIABLE_NAMES[8:11]),
+    "grade": (grade_mapping, VARIABLE_NAMES[11:14]),
+}
+
+# 0/1 の変数（チェックボックス）
+FLAGS = ["lvi", "hormone_receptor", "her2", "radiation", "chemotherapy", "endocrine", "targeted"]
+
+Z_95 = 1.96
+
+# 月ごとの時間グリッド（0〜10年）
+MONTHLY = np.arange(121) / 12
+
+
+def horizon_years(horizon):
+    """Follow-up time of a horizon label such as ``"5y"``, in years."""
+    return float(str(horizon).rstrip("y"))
+
+
+def hazard_from_survival(baseline_survival):
+    """(times, cumulative hazard) table through the baseline survival points."""
+    times = [0.0] + [horizon_years(year) for year in baseline_survival]
+    cumhaz = [0.0] + [-np.log(S0) for S0 in baseline_survival.values()]
+    order = np.argsort(times)
+    return np.array(times)[order], np.array(cumhaz)[order]
+
+
+def as_hazard_table(times, cumhaz):
+    """Validate a tabulated cumulative hazard, adding H0(0) = 0 if missing."""
+    times = np.asarray(times, dtype=float)
+    cumhaz = np.asarray(cumhaz, dtype=float)
+    if times.ndim != 1 or times.shape != cumhaz.shape:
+        raise ValueError("baseline hazard needs matching 1-D time and cumulative hazard columns")
+    if times[0] > 0:
+        times = np.concatenate([[0.0], times])
+        cumhaz = np.concatenate([[0.0], cumhaz])
+    if times[0] < 0 or np.any(np.diff(times) <= 0) or np.any(np.diff(cumhaz) < 0) or cumhaz[0] < 0:
+        raise ValueError("baseline hazard times must increase from 0 and the cumulative hazard must not decrease")
+    return times, cumhaz
+
+
+def read_baseline_hazard(path):
+    """Read a CSV file ``time,cumulative_hazard`` (time in years, one header line)."""
+    data = np.loadtxt(path, delimiter=",", skiprows=1, ndmin=2)
+    return as_hazard_table(data[:, 0], data[:, 1])
+
+
+@dataclass(frozen=True, eq=False)
+class Model:
+    """Coefficients of one model version, as arrays in ``variables`` order.
+
+    ``baseline_hazard`` is a ``(times, cumulative_hazard)`` table in years;
+    when omitted it is built from ``baseline_survival``.
+    """
+
+    version: str
+    log_hr: np.ndarray
+    se: np.ndarray
+    baseline_survival: dict
+    baseline_hazard: tuple = None
+
+    def __post_init__(self):
+        if self.baseline_hazard is None:
+            table = hazard_from_survival(self.baseline_survival)
+        else:
+            table = as_hazard_table(*self.baseline_hazard)
+        object.__setattr__(self, "baseline_hazard", table)
+
+
+DEFAULT_MODEL = Model(
+    version=MODEL_VERSION,
+    log_hr=np.array([loghr for _, _, loghr, _ in variables]),
+    se=np.array([se for _, _, _, se in variables]),
+    baseline_survival=dict(baseline_survival),
+)
+
+
+def make_input_dict(age, margin, t_stage, grade, lvi=False, hormone_receptor=False, her2=False,
+                    radiation=False, chemotherapy=False, endocrine=False, targeted=False):
+    """Build the 0/1 ``input_dict`` for one patient from the displayed labels."""
+    input_dict = {var: 0 for var in VARIABLE_NAMES}
+    input_dict[age_mapping[age]] = 1
+    input_dict[margin_mapping[margin]] = 1
+    input_dict[t_stage_mapping[t_stage]] = 1
+    input_dict[grade_mapping[grade]] = 1
+    input_dict.update({
+        "lvi": int(lvi),
+        "hormone_receptor": int(hormone_receptor),
+        "her2": int(her2),
+        "radiation": int(radiation),
+        "chemotherapy": int(chemotherapy),
+        "endocrine": int(endocrine),
+        "targeted": int(targeted)
+    })
+    return input_dict
+
+
+def design_row(input_dict):
+    """Return the length-21 design vector for an ``input_dict``."""
+    return np.array([input_dict[var] for var in VARIABLE_NAMES], dtype=float)
+
+
+def category_codes(values, column):
+    """Encode labels of a categorical column into level codes (0 = first level).
+
+    Both the English and Japanese labels of the mapping are accepted, as are
+    the variable names themselves and integer codes.
+    """
+    mapping, levels = CATEGORICAL[column]
+    values = np.asarray(values)
+    if values.dtype.kind in "iu":
+        codes = values.astype(np.int8)
+        if codes.size and (codes.min() < 0 or codes.max() >= len(levels)):
+            raise ValueError(f"{column}: codes must be in 0..{len(levels) - 1}")
+        return codes
+    lookup = {label: levels.index(var) for label, var in mapping.items()}
+    lookup.update({var: i for i, var in enumerate(levels)})
+    uniques, inverse = np.unique(values.astype(str), return_inverse=True)
+    unknown = [u for u in uniques if u not in lookup]
+    if unknown:
+        raise ValueError(f"{column}: unknown label(s) {unknown}")
+    return np.array([lookup[u] for u in uniques], dtype=np.int8)[inverse]
+
+
+def flag_values(values, flag):
+    """0/1 values of a flag column as int8; missing or other values raise ValueError."""
+    values = np.asarray(values)
+    if values.dtype.kind == "b":
+        return values.astype(np.int8)
+    try:
+        numeric = values.astype(float)
+    except (TypeError, ValueError):
+        raise ValueError(f"{flag}: values must be 0 or 1") from None
+    if np.isnan(numeric).any():
+        raise ValueError(f"{flag}: missing value(s)")
+    if np.any((numeric != 0) & (numeric != 1)):
+        raise ValueError(f"{flag}: values must be 0 or 1")
+    return numeric.astype(np.int8)
+
+
+def check_gating(hormone_receptor, her2, endocrine, targeted):
+    """Endocrine therapy requires HR+ and anti-HER2 therapy HER2+ (ValueError otherwise)."""
+    if np.any(np.asarray(endocrine) > np.asarray(hormone_receptor)):
+        raise ValueError("endocrine: endocrine therapy is only available for hormone receptor positive patients")
+    if np.any(np.asarray(targeted) > np.asarray(her2)):
+        raise ValueError("targeted: anti-HER2 therapy is only available for HER2 positive patients")
+
+
+def flag_columns(frame, n):
+    """Validated 0/1 flag columns (int8) of ``frame``; a missing column is taken as 0.
+
+    Flags must be 0/1 without missing values, and endocrine / anti-HER2
+    therapy require HR+ / HER2+ (``check_gating``).
+    """
+    flags = {flag: flag_values(frame[flag], flag) if flag in frame else np.zeros(n, dtype=np.int8)
+             for flag in FLAGS}
+    check_gating(flags["hormone_receptor"], flags["her2"], flags["endocrine"], flags["targeted"])
+    return flags
+
+
+def design_matrix(frame):
+    """Build the N×21 design matrix from categorical columns.
+
+    ``frame`` is a DataFrame (or any mapping of column name to array) with the
+    columns ``age``, ``margin``, ``t_stage``, ``grade`` holding display labels
+    or codes, and the 0/1 columns in ``FLAGS``.  A missing flag column is
+    taken as 0; invalid flags raise ValueError (``flag_columns``).
+    """
+    n = len(np.asarray(frame["age"]))
+    X = np.zeros((n, N_VARIABLES))
+    rows = np.arange(n)
+    for column, (_, levels) in CATEGORICAL.items():
+        offset = VARIABLE_NAMES.index(levels[0])
+        X[rows, offset + category_codes(frame[column], column)] = 1
+    for flag, values in flag_columns(frame, n).items():
+        X[:, VARIABLE_NAMES.index(flag)] = values
+    return X
+
+
+def cumulative_hazard(times, model=DEFAULT_MODEL):
+    """Baseline cumulative hazard H0(t), interpolated from the model's table."""
+    times = np.asarray(times, dtype=float)
+    knots, cumhaz = model.baseline_hazard
+    if np.any(times < 0) or np.any(times > knots[-1]):
+        raise ValueError(f"follow-up time must be within 0 to {knots[-1]:g} years")
+    return np.interp(times, knots, cumhaz)
+
+
+@functools.lru_cache(maxsize=64)
+def _hazard_grid(model, times):
+    grid = cumulative_hazard(np.array(times), model)
+    grid.flags.writeable = False
+    return grid
+
+
+def hazard_grid(times, model=DEFAULT_MODEL):
+    """Cached H0 at a time grid; computed once per model and grid."""
+    return _hazard_grid(model, tuple(np.atleast_1d(np.asarray(times, dtype=float)).tolist()))
+
+
+def _risk_bands(xb, se_total, H0, z=Z_95):
+    """(N, T) risk, lower and upper from xb, se_total and H0 at T times."""
+    # 生存率から再発率の計算: risk = 1 - S0 ** exp(xb) = 1 - exp(-H0 * exp(xb))
+    H0 = -np.asarray(H0)[None, :]
+    risk = -np.expm1(H0 * np.exp(xb)[:, None])
+    lower = -np.expm1(H0 * np.exp(xb - z * se_total)[:, None])
+    upper = -np.expm1(H0 * np.exp(xb + z * se_total)[:, None])
+    return risk, lower, upper
+
+
+def linear_predictor(X, model=DEFAULT_MODEL):
+    """xb and se_total of an N×21 design matrix."""
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    return X @ model.log_hr, np.sqrt((X * X) @ (model.se * model.se))
+
+
+def score(X, model=DEFAULT_MODEL):
+    """Score an N×21 design matrix (or one length-21 row).
+
+    Returns a dict with ``xb`` and ``se_total`` of shape (N,), the tuple of
+    ``horizons`` and ``risk``/``lower``/``upper`` of shape (N, len(horizons)).
+    """
+    xb, se_total = linear_predictor(X, model)
+    horizons = tuple(model.baseline_survival)
+    H0 = hazard_grid([horizon_years(year) for year in horizons], model)
+    risk, lower, upper = _risk_bands(xb, se_total, H0)
+    return {
+        "xb": xb,
+        "se_total": se_total,
+        "horizons": horizons,
+        "risk": risk,
+        "lower": lower,
+        "upper": upper,
+    }
+
+
+def output_columns(model=DEFAULT_MODEL):
+    """Names of the columns written by ``score_into``, in order."""
+    names = ["xb", "se_total"]
+    for year in model.baseline_survival:
+        names += [f"risk_{year}", f"lower_{year}", f"upper_{year}"]
+    return names
+
+
+def allocate_columns(n, model=DEFAULT_MODEL):
+    """Output buffers for ``n`` rows: one float64 block, a contiguous row per column."""
+    names = output_columns(model)
+    return dict(zip(names, np.empty((len(names), n))))
+
+
+def score_into(frame, out=None, model=DEFAULT_MODEL):
+    """Score categorical columns straight into preallocated 1-D columns.
+
+    ``frame`` holds the same columns as for ``design_matrix``.  ``xb`` and
+    ``se_total`` are summed from the per-level coefficients without building
+    the N×21 matrix, and every output of ``output_columns`` is written in
+    place into ``out`` (``allocate_columns`` by default), so the columns can
+    be handed to Arrow or pandas without a copy.  Values equal ``score`` up
+    to rounding in the last bit.
+    """
+    n = len(np.asarray(frame["age"]))
+    if out is None:
+        out = allocate_columns(n, model)
+    xb, se_total = out["xb"], out["se_total"]
+    xb.fill(0)
+    se_total.fill(0)
+    variance = model.se * model.se
+    tmp = np.empty(n)
+    for column, (_, levels) in CATEGORICAL.items():
+        index = [VARIABLE_NAMES.index(var) for var in levels]
+        codes = category_codes(frame[column], column)
+        xb += np.take(model.log_hr[index], codes, out=tmp)
+        se_total += np.take(variance[index], codes, out=tmp)
+    for flag, values in flag_columns(frame, n).items():
+        v = VARIABLE_NAMES.index(flag)
+        xb += np.multiply(values, model.log_hr[v], out=tmp)
+        se_total += np.multiply(values, variance[v], out=tmp)
+    np.sqrt(se_total, out=se_total)
+
+    horizons = tuple(model.baseline_survival)
+    H0 = hazard_grid([horizon_years(year) for year in horizons], model)
+    for kind, sign in (("risk", 0), ("lower", -1), ("upper", 1)):
+        # exp(xb ± z·se) を一度だけ計算し、各時点の列へ書き込む
+        np.multiply(se_total, sign * Z_95, out=tmp)
+        np.add(xb, tmp, out=tmp)
+        np.exp(tmp, out=tmp)
+        for j, year in enumerate(horizons):
+            column = out[f"{kind}_{year}"]
+            np.multiply(tmp, -H0[j], out=column)
+            np.expm1(column, out=column)
+            np.negative(column, out=column)
+    return out
+
+
+def risk_curves(X, times=MONTHLY, model=DEFAULT_MODEL):
+    """Risk curves over a time grid (years) as (N, T) arrays.
+
+    Returns ``times``, ``xb``, ``se_total`` and ``risk``/``lower``/``upper``.
+    """
+    xb, se_total = linear_predictor(X, model)
+    H0 = hazard_grid(times, model)
+    risk, lower, upper = _risk_bands(xb, se_total, H0)
+    return {
+        "times": np.asarray(times, dtype=float),
+        "xb": xb,
+        "se_total": se_total,
+        "risk": risk,
+        "lower": lower,
+        "upper": upper,
+    }
+
+
+def results_dict(scores, row=0):
+    """Return ``{"5y": (risk, lower, upper), ...}`` for one scored row."""
+    return {
+        year: (float(scores["risk"][row, j]), float(scores["lower"][row, j]), float(scores["upper"][row, j]))
+        for j, year in enumerate(scores["horizons"])
+    }
@@ -0,0 +1,227 @@
+## ibtr_policy.py - Population treatment-policy simulator
+"""Expected IBTR events in a cohort under a treatment policy.
+
+A policy is a list of declarative rules, applied in order, that rewrite the
+treatment flags of the patients they match::
+
+    {"rules": [{
+        "name": "omit radiation, 70+ HR+ pT1 Grade 1 on endocrine therapy",
+        "when": {"age": "70 or older", "hormone_receptor": 1, "t_stage": "pT1",
+                 "grade": "Grade 1", "endocrine": 1},
+        "set": {"radiation": 0}
+    }]}
+
+``when`` holds a label (any form accepted by ``ibtr_model.category_codes``)
+or a list of labels per categorical column, and 0/1 for flags; a later rule
+sees the flags rewritten by earlier ones.  ``set`` may change
+``radiation``, ``chemotherapy``, ``endocrine`` and ``targeted``; endocrine
+and anti-HER2 therapy are only switched on for HR+ and HER2+ patients.
+
+Because every patient is one of the ``ibtr_table.TABLE_SIZE`` profiles, the
+policy is evaluated once on the profiles as a key → key map.  A cohort is
+then reduced, chunk by chunk, to a (strata × profiles) count matrix, from
+which the baseline and counterfactual expected events, their difference
+and its delta-method uncertainty (from the covariance of
+``ibtr_uncertainty``) follow exactly.  Memory does not depend on the cohort
+size.
+
+    python ibtr_policy.py registry.parquet policy.json --by age margin grade -o policy_effect.csv
+"""
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+
+from ibtr_counterfactual import TREATMENTS
+from ibtr_model import CATEGORICAL, DEFAULT_MODEL, FLAGS, N_VARIABLES, Z_95, category_codes
+from ibtr_table import TABLE_SIZE, codes_from_keys, enumerate_design, keys_from_codes, model_table
+from ibtr_uncertainty import as_covariance, param_mean
+
+DEFAULT_BY = ("age", "margin", "grade")
+# 水準の表示名（英語ラベル）
+LEVEL_LABELS = {
+    column: [next(label for label, var in mapping.items() if var == level) for level in levels]
+    for column, (mapping, levels) in CATEGORICAL.items()
+}
+
+
+def parse_rules(spec):
+    """Validate a rule set (a list, or a dict with ``rules``) into code form."""
+    rules = spec["rules"] if isinstance(spec, dict) else spec
+    parsed = []
+    for i, rule in enumerate(rules):
+        name = rule.get("name", f"rule {i + 1}")
+        unknown = set(rule) - {"name", "when", "set"}
+        if unknown:
+            raise ValueError(f"{name}: unknown key(s) {sorted(unknown)}")
+        when = {}
+        for column, value in rule.get("when", {}).items():
+            values = value if isinstance(value, list) else [value]
+            if column in CATEGORICAL:
+                when[column] = np.unique(category_codes(values, column))
+            elif column in FLAGS:
+                if any(v not in (0, 1) for v in values):
+                    raise ValueError(f"{name}: {column} must be 0 or 1")
+                when[column] = np.unique(np.array(values, dtype=np.int64))
+            else:
+                raise ValueError(f"{name}: unknown column {column!r} in 'when'")
+        changes = rule.get("set", {})
+        if not changes:
+            raise ValueError(f"{name}: 'set' is empty")
+        for flag, value in changes.items():
+            if flag not in TREATMENTS:
+                raise ValueError(f"{name}: 'set' may only change {TREATMENTS}, not {flag!r}")
+            if value not in (0, 1):
+                raise ValueError(f"{name}: {flag} must be set to 0 or 1")
+        parsed.append((name, when, {flag: int(value) for flag, value in changes.items()}))
+    return parsed
+
+
+def load_rules(path):
+    with open(path, encoding="utf-8") as f:
+        return parse_rules(json.load(f))
+
+
+def policy_map(rules):
+    """Counterfactual key of every profile key, and the profiles each rule changed."""
+    columns = codes_from_keys(np.arange(TABLE_SIZE))
+    columns = {column: np.array(codes, dtype=np.int64) for column, codes in columns.items()}
+    matched = {}
+    for name, when, changes in rules:
+        mask = np.ones(TABLE_SIZE, dtype=bool)
+        for column, codes in when.items():
+            mask &= np.isin(columns[column], codes)
+        for flag, value in changes.items():
+            allowed = mask
+            if value and flag == "endocrine":
+                allowed = mask & (columns["hormone_receptor"] == 1)
+            elif value and flag == "targeted":
+                allowed = mask & (columns["her2"] == 1)
+            columns[flag] = np.where(allowed, value, columns[flag])
+        matched[name] = mask
+    return keys_from_codes(**columns), matched
+
+
+def strata(keys, by=DEFAULT_BY):
+    """Stratum index of every key, and the number of strata."""
+    if not by:
+        return np.zeros(len(np.atleast_1d(keys)), dtype=np.int64), 1
+    columns = codes_from_keys(keys)
+    sizes = [len(LEVEL_LABELS[column]) if column in CATEGORICAL else 2 for column in by]
+    return np.ravel_multi_index(tuple(columns[column] for column in by), sizes), int(np.prod(sizes))
+
+
+def stratum_counts(key_chunks, by=DEFAULT_BY):
+    """(strata × TABLE_SIZE) patient counts, accumulated over key chunks."""
+    _, n_strata = strata(np.zeros(1, dtype=np.int64), by)
+    stratum_of_key, _ = strata(np.arange(TABLE_SIZE), by)
+    counts = np.zeros(TABLE_SIZE, dtype=np.int64)
+    for keys in key_chunks:
+        counts += np.bincount(keys, minlength=TABLE_SIZE)
+    # キーが層を決めるので、層 × キーの表はキーごとの人数から作れる
+    matrix = np.zeros((n_strata, TABLE_SIZE), dtype=np.int64)
+    matrix[stratum_of_key, np.arange(TABLE_SIZE)] = counts
+    return matrix
+
+
+def risk_gradients(model=DEFAULT_MODEL):
+    """Risk (TABLE_SIZE, H) of every profile and its gradient (TABLE_SIZE, H, 21+H)."""
+    X = enumerate_design()
+    log_h0 = param_mean(model)[N_VARIABLES:]
+    risk = model_table(model).values[..., 0]
+    slope = np.exp(X @ model.log_hr)[:, None] * np.exp(log_h0)[None, :] * (1 - risk)
+    grad = np.zeros((TABLE_SIZE, len(log_h0), N_VARIABLES + len(log_h0)))
+    grad[..., :N_VARIABLES] = slope[:, :, None] * X[:, None, :]
+    for j in range(len(log_h0)):
+        grad[:, j, N_VARIABLES + j] = slope[:, j]
+    return risk, grad
+
+
+def summarise(counts, rewrite, by=DEFAULT_BY, model=DEFAULT_MODEL, cov=None, z=Z_95):
+    """Per-stratum and total expected events under baseline and policy."""
+    cov = as_covariance(cov, model)
+    risk, grad = risk_gradients(model)
+    policy_counts = np.zeros_like(counts)
+    np.add.at(policy_counts.T, rewrite, counts.T)
+    changed = counts[:, rewrite != np.arange(TABLE_SIZE)].sum(axis=1)
+    delta = policy_counts - counts
+    horizons = tuple(model.baseline_survival)
+
+    def sums(matrix):
+        # 層ごと + 全体の行
+        return np.vstack([matrix, matrix.sum(axis=0, keepdims=True)])
+
+    n = sums(counts.sum(axis=1, keepdims=True))[:, 0]
+    base = sums(counts @ risk)
+    policy = sums(policy_counts @ risk)
+    g = np.tensordot(delta, grad, axes=(1, 0)).reshape(len(counts), -1)
+    g = sums(g).reshape(-1, len(horizons), cov.shape[0])
+    se = np.sqrt(np.maximum(np.einsum("shp,pq,shq->sh", g, cov, g), 0.0))
+
+    sizes = [len(LEVEL_LABELS[column]) if column in CATEGORICAL else 2 for column in by]
+    labels = [np.unravel_index(s, sizes) for s in range(len(counts))] if by else [()] * len(counts)
+    frame = pd.DataFrame({
+        column: [LEVEL_LABELS[column][codes[i]] if column in CATEGORICAL else codes[i] for codes in labels] + ["All"]
+        for i, column in enumerate(by)
+    })
+    frame["patients"] = n
+    frame["changed"] = np.append(changed, changed.sum())
+    for j, year in enumerate(horizons):
+        diff = policy[:, j] - base[:, j]
+        frame[f"expected_{year}"] = base[:, j]
+        frame[f"expected_policy_{year}"] = policy[:, j]
+        frame[f"difference_{year}"] = diff
+        frame[f"difference_se_{year}"] = se[:, j]
+        frame[f"difference_lower_{year}"] = diff - z * se[:, j]
+        frame[f"difference_upper_{year}"] = diff + z * se[:, j]
+    if not by:
+        return frame.iloc[-1:].reset_index(drop=True)
+    return frame[(frame["patients"] > 0).to_numpy()].reset_index(drop=True)
+
+
+def simulate(key_chunks, rules, by=DEFAULT_BY, model=DEFAULT_MODEL, cov=None, z=Z_95):
+    """Stream patient keys and return the grouped policy effect.
+
+    ``key_chunks`` is an iterable of ``ibtr_table.patient_keys`` arrays;
+    ``rules`` is the output of ``parse_rules``.  The expected events are the
+    sums of the predicted risks at each horizon; the uncertainty is that of
+    the model parameters.
+    """
+    rewrite, _ = policy_map(rules)
+    return summarise(stratum_counts(key_chunks, by), rewrite, by, model, cov, z)
+
+
+def main(argv=None):
+    from ibtr_batch import read_chunks
+    from ibtr_registry import current_model, default_registry
+    from ibtr_table import patient_keys
+
+    parser = argparse.ArgumentParser(description="Simulate a treatment policy on a registry file.")
+    parser.add_argument("input", help="CSV or Parquet cohort file")
+    parser.add_argument("rules", help="JSON rule set")
+    parser.add_argument("--by", nargs="*", default=list(DEFAULT_BY),
+                        choices=list(CATEGORICAL) + FLAGS, help="stratify by these columns")
+    parser.add_argument("-o", "--output", help="write the table to this CSV file")
+    parser.add_argument("--covariance", help="parameter covariance (.npy or .csv); default diag(SE²)")
+    parser.add_argument("--version", help="model version (default: the served version)")
+    parser.add_argument("--chunksize", type=int, default=500_000)
+    args = parser.parse_args(argv)
+
+    model = default_registry().get(args.version) if args.version else current_model()
+    cov = None
+    if args.covariance:
+        from ibtr_uncertainty import load_covariance
+
+        cov = load_covariance(args.covariance, model)
+    rules = load_rules(args.rules)
+    keys = (patient_keys(frame) for frame in read_chunks(args.input, args.chunksize))
+    frame = simulate(keys, rules, tuple(args.by), model, cov)
+    if args.output:
+        frame.to_csv(args.output, index=False)
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(frame.to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+
+
+if __name__ == "__main__":
+    main()
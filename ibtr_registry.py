@@ -0,0 +1,366 @@
+## ibtr_registry.py - Versioned model registry with memory-mapped coefficient artifacts
+"""Versioned IBTR model registry.
+
+Every model version lives in its own directory under ``models/`` (or
+``$IBTR_MODEL_DIR``)::
+
+    models/v1.61/coefficients-<sha>.npy     float64 (2, 21): log(HR), SE in ``variables`` order
+    models/v1.61/baseline_hazard-<sha>.npy  float64 (2, K): time (years), cumulative hazard
+    models/v1.61/model.json                 version, labels, label mappings, baseline survival,
+                                            array file names and SHA-256
+
+The ``.npy`` files are opened with ``mmap_mode="r"``, so the app servers and
+batch workers on one host share the same pages.  Array files are named after
+their content and never rewritten; ``model.json`` is replaced last and
+atomically, so a reader always sees a ``model.json`` together with the arrays
+it names, even while the same version is being republished.  Arrays no
+longer referenced are removed on the next publish (one generation later).
+``ModelRegistry.get`` reloads a version when its ``model.json`` changes and
+``versions`` picks up new directories, so a new version can be published
+without restarting the server.
+
+The coefficients of the versions shipped with the tool have one source in
+code: ``ibtr_model.variables`` (the current version, also
+``ibtr_model.DEFAULT_MODEL``, the default of every library function) and
+``LEGACY_V1_0``.  ``build`` generates their directories from these, and
+``check`` verifies that the published files still match them exactly.
+
+    python ibtr_registry.py build                          # write v1.0 and the current version
+    python ibtr_registry.py check                          # published files match the sources
+    python ibtr_registry.py compare cohort.csv --versions 1.0 1.61
+"""
+import argparse
+import functools
+import hashlib
+import io
+import json
+import os
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+
+import ibtr_model
+from ibtr_model import DEFAULT_MODEL, VARIABLE_NAMES, Model, design_matrix, score
+
+MODEL_DIR = os.environ.get(
+    "IBTR_MODEL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+)
+
+# ver1.0（2025年4月11日公表）の係数（旧 ibtr_app.py の data）
+# 変数名, 表示名, log(HR), SE  — 抗HER2療法は ver1.0 のモデルに含まれない
+LEGACY_V1_0 = [
+    ("agecategory_<40", "40歳未満", 0.925107, 0.447266),
+    ("agecategory_40s", "40代（参照）", 0.0, 0.0),
+    ("agecategory_50s", "50代", -0.260198, 0.132907),
+    ("agecategory_60s", "60代", -0.537844, 0.169046),
+    ("agecategory_70+", "70歳以上", -0.642398, 0.188960),
+    ("finalmargin_negative", "陰性断端（参照）", 0.0, 0.0),
+    ("finalmargin_close(<5mm)", "近接断端", 1.112084, 0.523271),
+    ("finalmargin_positive", "陽性断端", 1.481605, 0.416883),
+    ("pT_1", "pT1（参照）", 0.0, 0.0),
+    ("pT_2", "pT2", 1.123930, 0.284657),
+    ("pT_3", "pT3", 1.789473, 0.350000),
+    ("grade_1", "Grade 1（参照）", 0.0, 0.0),
+    ("grade_2", "Grade 2", 0.625418, 0.274052),
+    ("grade_3", "Grade 3", 1.213716, 0.273415),
+    ("lvi", "LVIあり", 0.774492, 0.311122),
+    ("hormone_receptor", "ホルモン受容体陽性", -0.756010, 0.377652),
+    ("her2", "HER2陽性", -0.030972, 0.295476),
+    ("radiation", "放射線治療あり", -1.010091, 0.284721),
+    ("chemotherapy", "化学療法あり", -0.368108, 0.299216),
+    ("endocrine", "周術期内分泌療法あり", -0.808540, 0.300993),
+    ("targeted", "抗HER2療法あり", 0.0, 0.0),
+]
+LEGACY_V1_0_BASELINE = {"5y": 0.94, "10y": 0.86}
+
+
+@dataclass(frozen=True, eq=False)
+class ModelEntry:
+    """A loaded model version with its display labels and label mappings."""
+
+    model: Model
+    labels: dict
+    mappings: dict
+    path: str
+    stamp: tuple
+
+
+def version_key(version):
+    return tuple(int(part) for part in str(version).split("."))
+
+
+def _sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _replace(path, data):
+    tmp = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _referenced(directory):
+    """Array files named by the ``model.json`` in ``directory`` (empty if none)."""
+    try:
+        with open(os.path.join(directory, "model.json"), encoding="utf-8") as f:
+            return set(json.load(f)["sha256"])
+    except (FileNotFoundError, ValueError, KeyError):
+        return set()
+
+
+def write_model(model, labels, mappings, root=MODEL_DIR):
+    """Publish one version; ``model.json`` is replaced last and atomically."""
+    directory = os.path.join(root, f"v{model.version}")
+    os.makedirs(directory, exist_ok=True)
+    previous = _referenced(directory)
+    arrays = {
+        "coefficients": np.stack([model.log_hr, model.se]),
+        "baseline_hazard": np.stack(model.baseline_hazard),
+    }
+    files, checksums = {}, {}
+    for role, array in arrays.items():
+        buffer = io.BytesIO()
+        np.save(buffer, np.ascontiguousarray(array, dtype="<f8"))
+        data = buffer.getvalue()
+        checksum = hashlib.sha256(data).hexdigest()
+        # 内容ごとに別名のファイルにし、公開中のファイルは書き換えない
+        name = f"{role}-{checksum[:16]}.npy"
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            _replace(path, data)
+        files[role], checksums[name] = name, checksum
+    meta = {
+        "version": model.version,
+        "variables": VARIABLE_NAMES,
+        "labels": labels,
+        "baseline_survival": model.baseline_survival,
+        "mappings": mappings,
+        "files": files,
+        "sha256": checksums,
+    }
+    _replace(os.path.join(directory, "model.json"), json.dumps(meta, ensure_ascii=False, indent=1).encode("utf-8"))
+    # 読み込み途中のプロセスのため、直前の世代のファイルは残す
+    keep = previous | set(checksums)
+    for name in os.listdir(directory):
+        if name.endswith(".npy") and name not in keep:
+            os.remove(os.path.join(directory, name))
+    return directory
+
+
+def _stamp(path):
+    """Changes whenever ``path`` is replaced (new inode) or modified."""
+    st = os.stat(path)
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def read_model(directory):
+    """Load one version directory, memory-mapping the coefficient arrays."""
+    meta_path = os.path.join(directory, "model.json")
+    stamp = _stamp(meta_path)
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta["variables"] != VARIABLE_NAMES:
+        raise ValueError(f"{directory}: variables do not match the scoring engine")
+    arrays = {}
+    for name, checksum in meta["sha256"].items():
+        path = os.path.join(directory, name)
+        if _sha256(path) != checksum:
+            raise ValueError(f"{path}: checksum mismatch")
+        arrays[name] = np.load(path, mmap_mode="r")
+    files = meta.get("files", {"coefficients": "coefficients.npy", "baseline_hazard": "baseline_hazard.npy"})
+    coefficients = arrays[files["coefficients"]]
+    hazard = arrays[files["baseline_hazard"]]
+    model = Model(
+        version=meta["version"],
+        log_hr=coefficients[0],
+        se=coefficients[1],
+        baseline_survival=meta["baseline_survival"],
+        baseline_hazard=(hazard[0], hazard[1]),
+    )
+    return ModelEntry(model, meta["labels"], meta["mappings"], directory, stamp)
+
+
+class ModelRegistry:
+    """Model versions under ``root``, reloaded when their ``model.json`` changes."""
+
+    def __init__(self, root=MODEL_DIR):
+        self.root = root
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def versions(self):
+        """Published versions, oldest first."""
+        if not os.path.isdir(self.root):
+            return []
+        found = [
+            name[1:] for name in os.listdir(self.root)
+            if name.startswith("v") and os.path.isfile(os.path.join(self.root, name, "model.json"))
+        ]
+        return sorted(found, key=version_key)
+
+    def entry(self, version=None):
+        """The (re)loaded entry of ``version``, the latest one if None."""
+        if version is None:
+            versions = self.versions()
+            if not versions:
+                raise LookupError(f"no model versions in {self.root}")
+            version = versions[-1]
+        directory = os.path.join(self.root, f"v{version}")
+        try:
+            stamp = _stamp(os.path.join(directory, "model.json"))
+        except FileNotFoundError:
+            raise LookupError(f"model version {version} not found in {self.root}") from None
+        with self._lock:
+            entry = self._entries.get(version)
+            if entry is None or entry.stamp != stamp:
+                entry = self._entries[version] = read_model(directory)
+            return entry
+
+    def get(self, version=None):
+        return self.entry(version).model
+
+    def score_versions(self, X, versions=None):
+        """Score the same design matrix against several versions side by side."""
+        versions = versions or self.versions()
+        return {version: score(X, self.get(version)) for version in versions}
+
+
+@functools.lru_cache(maxsize=None)
+def default_registry():
+    return ModelRegistry()
+
+
+def current_model():
+    """Model to serve: ``$IBTR_MODEL_VERSION`` or the latest published version.
+
+    Falls back to ``ibtr_model.DEFAULT_MODEL`` when nothing is published.
+    """
+    registry = default_registry()
+    version = os.environ.get("IBTR_MODEL_VERSION")
+    if version is None and not registry.versions():
+        return DEFAULT_MODEL
+    return registry.get(version)
+
+
+def source_models():
+    """``(model, labels, mappings)`` of the versions defined in code: v1.0 and the current one."""
+    v1_0 = Model(
+        version="1.0",
+        log_hr=np.array([loghr for _, _, loghr, _ in LEGACY_V1_0]),
+        se=np.array([se for _, _, _, se in LEGACY_V1_0]),
+        baseline_survival=dict(LEGACY_V1_0_BASELINE),
+    )
+    v1_0_mappings = {
+        "age": {"40歳未満": "agecategory_<40", "40代（参照）": "agecategory_40s", "50代": "agecategory_50s",
+                "60代": "agecategory_60s", "70歳以上": "agecategory_70+"},
+        "margin": {"陰性断端（参照）": "finalmargin_negative", "近接断端": "finalmargin_close(<5mm)",
+                   "陽性断端": "finalmargin_positive"},
+        "t_stage": {"pT1（参照）": "pT_1", "pT2": "pT_2", "pT3": "pT_3"},
+        "grade": {"Grade 1（参照）": "grade_1", "Grade 2": "grade_2", "Grade 3": "grade_3"},
+    }
+    current_mappings = {column: dict(mapping) for column, (mapping, _) in ibtr_model.CATEGORICAL.items()}
+    return [
+        (v1_0, {var: label for var, label, _, _ in LEGACY_V1_0}, v1_0_mappings),
+        (DEFAULT_MODEL, {var: label for var, label, _, _ in ibtr_model.variables}, current_mappings),
+    ]
+
+
+def build_all(root=MODEL_DIR):
+    """Write v1.0 and the engine's current version to ``root``."""
+    return [write_model(model, labels, mappings, root) for model, labels, mappings in source_models()]
+
+
+def check_sources(root=MODEL_DIR):
+    """Differences between the published versions and ``source_models`` (empty if they agree)."""
+    registry = ModelRegistry(root)
+    problems = []
+    for model, labels, mappings in source_models():
+        try:
+            entry = registry.entry(model.version)
+        except LookupError:
+            problems.append(f"v{model.version}: not published")
+            continue
+        published = entry.model
+        for name, ours, theirs in (
+            ("log(HR)", model.log_hr, published.log_hr),
+            ("SE", model.se, published.se),
+            ("baseline hazard times", model.baseline_hazard[0], published.baseline_hazard[0]),
+            ("baseline cumulative hazard", model.baseline_hazard[1], published.baseline_hazard[1]),
+        ):
+            if not np.array_equal(ours, theirs):
+                problems.append(f"v{model.version}: {name} differ from the source in code")
+        if dict(published.baseline_survival) != dict(model.baseline_survival):
+            problems.append(f"v{model.version}: baseline survival differs from the source in code")
+        if entry.labels != labels or entry.mappings != mappings:
+            problems.append(f"v{model.version}: labels or mappings differ from the source in code")
+    return problems
+
+
+def compare(path, versions, chunksize=100_000, registry=None):
+    """Stream a cohort file and summarise risk differences against the first version."""
+    from ibtr_batch import read_chunks
+
+    registry = registry or default_registry()
+    reference, others = versions[0], versions[1:]
+    n = 0
+    stats = {}
+    for frame in read_chunks(path, chunksize):
+        scored = registry.score_versions(design_matrix(frame), versions)
+        n += len(frame)
+        for version in others:
+            diff = scored[version]["risk"] - scored[reference]["risk"]
+            for j, year in enumerate(scored[reference]["horizons"]):
+                s = stats.setdefault((version, year), {"sum": 0.0, "sum_abs": 0.0, "max_abs": 0.0})
+                s["sum"] += diff[:, j].sum()
+                s["sum_abs"] += np.abs(diff[:, j]).sum()
+                s["max_abs"] = max(s["max_abs"], float(np.abs(diff[:, j]).max(initial=0.0)))
+    return {
+        key: {"mean": s["sum"] / n, "mean_abs": s["sum_abs"] / n, "max_abs": s["max_abs"]}
+        for key, s in stats.items()
+    } if n else {}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the versioned IBTR model registry.")
+    parser.add_argument("--root", default=MODEL_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("build", help="write v1.0 and the current engine version")
+    sub.add_parser("check", help="verify the published v1.0 and current version against the code")
+    sub.add_parser("list", help="list published versions")
+    cmp_parser = sub.add_parser("compare", help="score a cohort file against several versions")
+    cmp_parser.add_argument("input")
+    cmp_parser.add_argument("--versions", nargs="+")
+    cmp_parser.add_argument("--chunksize", type=int, default=100_000)
+    args = parser.parse_args(argv)
+
+    registry = ModelRegistry(args.root)
+    if args.command == "build":
+        for directory in build_all(args.root):
+            print(directory)
+    elif args.command == "check":
+        problems = check_sources(args.root)
+        for problem in problems:
+            print(problem)
+        if problems:
+            raise SystemExit(1)
+        print("published models match the sources in code")
+    elif args.command == "list":
+        for version in registry.versions():
+            entry = registry.entry(version)
+            print(f"{version}\t{entry.path}\t{dict(entry.model.baseline_survival)}")
+    else:
+        versions = args.versions or registry.versions()
+        if len(versions) < 2:
+            parser.error("compare needs at least two versions")
+        result = compare(args.input, versions, args.chunksize, registry)
+        print(f"reference: v{versions[0]}")
+        for (version, year), s in result.items():
+            print(f"v{version} {year}: mean diff {s['mean']*100:+.2f} pt, "
+                  f"mean |diff| {s['mean_abs']*100:.2f} pt, max |diff| {s['max_abs']*100:.2f} pt")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+## ibtr_service.py - Local JSON scoring service (ASGI) for EHR integrations
+"""Local JSON scoring service around the IBTR model.
+
+A plain ASGI application without framework dependencies.  Run it with any
+ASGI server, e.g. ``uvicorn ibtr_service:app --port 8502``; integration tests
+can call ``app`` in-process, e.g. through ``httpx.ASGITransport``.
+
+Endpoints::
+
+    GET  /health         {"status": "ok", "model_version": "1.61"}
+    POST /score          one patient object
+    POST /score/batch    {"patients": [patient, ...]}
+
+A patient object has ``age``, ``margin``, ``t_stage`` and ``grade`` (the
+English or Japanese labels of the app, or the variable names) and the
+optional booleans ``lvi``, ``hormone_receptor``, ``her2``, ``radiation``,
+``chemotherapy``, ``endocrine`` and ``targeted``.  Endocrine therapy requires
+``hormone_receptor`` and anti-HER2 therapy requires ``her2``, as in the app.
+Invalid input is answered with 422 and a list of errors.
+
+Batches are scored with vectorized table lookups.  Batches larger than
+``$IBTR_SERVICE_OFFLOAD`` patients (default 2000) are parsed, scored and
+serialized in a process pool of ``$IBTR_SERVICE_WORKERS`` workers so the
+event loop stays responsive.
+"""
+import asyncio
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from ibtr_model import CATEGORICAL, FLAGS
+from ibtr_registry import current_model
+from ibtr_table import keys_from_codes, lookup, model_table
+
+MAX_BODY_BYTES = 64 * 1024 * 1024
+OFFLOAD_THRESHOLD = int(os.environ.get("IBTR_SERVICE_OFFLOAD", 2000))
+WORKERS = int(os.environ.get("IBTR_SERVICE_WORKERS", os.cpu_count() or 1))
+
+# 表示ラベル・変数名 → 水準コード
+LABEL_CODES = {
+    column: {**{label: levels.index(var) for label, var in mapping.items()},
+             **{var: i for i, var in enumerate(levels)}}
+    for column, (mapping, levels) in CATEGORICAL.items()
+}
+
+
+class ValidationError(Exception):
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def validate_patient(patient, index=None):
+    """Return (category codes, flags) of one patient, or raise ValidationError."""
+    errors = []
+
+    def error(field, message):
+        errors.append({"index": index, "field": field, "message": message} if index is not None
+                      else {"field": field, "message": message})
+
+    if not isinstance(patient, dict):
+        error(None, "patient must be a JSON object")
+        raise ValidationError(errors)
+    codes = []
+    for column, lookup_codes in LABEL_CODES.items():
+        value = patient.get(column)
+        if not isinstance(value, str) or value not in lookup_codes:
+            error(column, f"must be one of {sorted(lookup_codes)}" if value is not None else "is required")
+        else:
+            codes.append(lookup_codes[value])
+    flags = []
+    for flag in FLAGS:
+        value = patient.get(flag, False)
+        if value not in (True, False):  # 0/1 も True/False と等しい
+            error(flag, "must be a boolean")
+        flags.append(bool(value))
+    unknown = set(patient) - set(LABEL_CODES) - set(FLAGS)
+    for field in sorted(unknown):
+        error(field, "unknown field")
+    flag = dict(zip(FLAGS, flags))
+    if flag["endocrine"] and not flag["hormone_receptor"]:
+        error("endocrine", "endocrine therapy requires hormone_receptor")
+    if flag["targeted"] and not flag["her2"]:
+        error("targeted", "anti-HER2 therapy requires her2")
+    if errors:
+        raise ValidationError(errors)
+    return codes, flags
+
+
+def score_patients(patients):
+    """Validate and score a list of patient objects in one vectorized lookup."""
+    codes, flags, errors = [], [], []
+    for i, patient in enumerate(patients):
+        try:
+            c, f = validate_patient(patient, i)
+        except ValidationError as e:
+            errors.extend(e.errors)
+            continue
+        codes.append(c)
+        flags.append(f)
+    if errors:
+        raise ValidationError(errors)
+    model = current_model()
+    table = model_table(model)
+    codes = np.array(codes, dtype=np.int64).reshape(-1, len(LABEL_CODES))
+    flags = np.array(flags, dtype=np.int64).reshape(-1, len(FLAGS))
+    keys = keys_from_codes(*codes.T, *flags.T)
+    scores = lookup(table, keys)
+    horizons = list(scores["horizons"])
+    values = {name: scores[name].tolist() for name in ("risk", "lower", "upper")}
+    results = [
+        {name: dict(zip(horizons, values[name][i])) for name in ("risk", "lower", "upper")}
+        for i in range(len(keys))
+    ]
+    return {"model_version": model.version, "horizons": horizons, "results": results}
+
+
+def handle(method, path, body):
+    """(status, payload) of one request; runs in the event loop or a worker."""
+    if path == "/health":
+        if method != "GET":
+            return 405, {"error": "method not allowed"}
+        return 200, {"status": "ok", "model_version": current_model().version}
+    if path not in ("/score", "/score/batch"):
+        return 404, {"error": "not found"}
+    if method != "POST":
+        return 405, {"error": "method not allowed"}
+    try:
+        data = json.loads(body)
+    except (ValueError, UnicodeDecodeError):
+        return 400, {"error": "request body must be JSON"}
+    try:
+        if path == "/score":
+            result = score_patients([data])
+            return 200, {"model_version": result["model_version"], "horizons": result["horizons"],
+                         **result["results"][0]}
+        if not isinstance(data, dict) or not isinstance(data.get("patients"), list):
+            return 422, {"errors": [{"field": "patients", "message": "must be a list of patient objects"}]}
+        return 200, score_patients(data["patients"])
+    except ValidationError as e:
+        if path == "/score":
+            for err in e.errors:
+                err.pop("index", None)
+        return 422, {"errors": e.errors}
+
+
+def handle_bytes(method, path, body):
+    """``handle`` with the response already serialized, for the worker pool."""
+    status, payload = handle(method, path, body)
+    return status, json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+
+class ScoringApp:
+    """ASGI application; large batches go to a process pool."""
+
+    def __init__(self, workers=WORKERS, offload_threshold=OFFLOAD_THRESHOLD):
+        self.workers = workers
+        self.offload_threshold = offload_threshold
+        self._pool = None
+
+    def pool(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        body = bytearray()
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if len(body) > MAX_BODY_BYTES:
+                await self._send(send, 413, json.dumps({"error": "request body too large"}).encode())
+                return
+            if not message.get("more_body"):
+                break
+        method, path = scope["method"], scope["path"].rstrip("/") or "/"
+        # 大きなバッチは解析・計算・直列化ごとワーカープロセスで実行
+        # （患者数は解析前に "{" の数で見積もる）
+        if path == "/score/batch" and body.count(b"{") > self.offload_threshold:
+            loop = asyncio.get_running_loop()
+            status, payload = await loop.run_in_executor(self.pool(), handle_bytes, method, path, bytes(body))
+        else:
+            status, payload = handle_bytes(method, path, bytes(body))
+        await self._send(send, status, payload)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                current_model()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    @staticmethod
+    async def _send(send, status, payload):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json; charset=utf-8"),
+                (b"content-length", str(len(payload)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": payload})
+
+
+app = ScoringApp()
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve the IBTR model as a local JSON API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8502)
+    args = parser.parse_args(argv)
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("ibtr_service needs an ASGI server, e.g. pip install uvicorn") from None
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
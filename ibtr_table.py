@@ -0,0 +1,235 @@
+## ibtr_table.py - Precomputed risk table over the full covariate space
+"""Precomputed IBTR risk table with O(1) lookup.
+
+The input space of the tool is finite, so every valid patient profile is
+scored once and stored in a dense array indexed by a mixed-radix integer key.
+The digits of the key are, from most to least significant::
+
+    age (5) × margin (3) × t_stage (3) × grade (3) × lvi (2) × radiation (2)
+    × chemotherapy (2) × hr_state (3) × her2_state (3)
+
+``hr_state`` is 0 = HR−, 1 = HR+ without endocrine, 2 = HR+ with endocrine,
+and ``her2_state`` likewise for HER2 and anti-HER2 therapy, so endocrine
+therapy without HR+ (or anti-HER2 without HER2+) has no key at all and every
+key in ``range(TABLE_SIZE)`` is a valid profile.
+
+Build an artifact for offline clients with::
+
+    python ibtr_table.py build -o ibtr_risk_table_v1.61.npz
+"""
+import argparse
+import hashlib
+import os
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+
+from ibtr_model import CATEGORICAL, DEFAULT_MODEL, VARIABLE_NAMES, category_codes, check_gating, flag_columns, score
+
+RADICES = (5, 3, 3, 3, 2, 2, 2, 3, 3)
+TABLE_SIZE = int(np.prod(RADICES))
+
+
+@dataclass(frozen=True, eq=False)
+class RiskTable:
+    """Risk, lower and upper bound for every key and horizon.
+
+    ``values`` has shape (TABLE_SIZE, len(horizons), 3).
+    """
+
+    model_version: str
+    fingerprint: str
+    horizons: tuple
+    values: np.ndarray
+
+
+def model_fingerprint(model=DEFAULT_MODEL):
+    """SHA-256 of the model version and its coefficients."""
+    h = hashlib.sha256(model.version.encode())
+    h.update(np.ascontiguousarray(model.log_hr, dtype=np.float64).tobytes())
+    h.update(np.ascontiguousarray(model.se, dtype=np.float64).tobytes())
+    for year, S0 in model.baseline_survival.items():
+        h.update(f"{year}={S0!r}".encode())
+    for column in model.baseline_hazard:
+        h.update(np.ascontiguousarray(column, dtype=np.float64).tobytes())
+    return h.hexdigest()
+
+
+def table_checksum(table):
+    """SHA-256 tying the table values to the model fingerprint."""
+    h = hashlib.sha256(table.fingerprint.encode())
+    h.update(",".join(table.horizons).encode())
+    h.update(np.ascontiguousarray(table.values, dtype=np.float64).tobytes())
+    return h.hexdigest()
+
+
+def keys_from_codes(age, margin, t_stage, grade, lvi, hormone_receptor, her2,
+                    radiation, chemotherapy, endocrine, targeted):
+    """Vectorized mixed-radix keys from category codes and 0/1 flags."""
+    hormone_receptor = np.asarray(hormone_receptor, dtype=np.int64)
+    her2 = np.asarray(her2, dtype=np.int64)
+    endocrine = np.asarray(endocrine, dtype=np.int64)
+    targeted = np.asarray(targeted, dtype=np.int64)
+    check_gating(hormone_receptor, her2, endocrine, targeted)
+    digits = (age, margin, t_stage, grade, lvi, radiation, chemotherapy,
+              hormone_receptor * (1 + endocrine), her2 * (1 + targeted))
+    return np.ravel_multi_index(tuple(np.asarray(d, dtype=np.int64) for d in digits), RADICES)
+
+
+def codes_from_keys(keys):
+    """Inverse of ``keys_from_codes``: dict of category codes and 0/1 flags."""
+    (age, margin, t_stage, grade, lvi, radiation, chemotherapy,
+     hr_state, her2_state) = np.unravel_index(np.asarray(keys), RADICES)
+    return {
+        "age": age, "margin": margin, "t_stage": t_stage, "grade": grade, "lvi": lvi,
+        "hormone_receptor": (hr_state > 0).astype(np.int64), "her2": (her2_state > 0).astype(np.int64),
+        "radiation": radiation, "chemotherapy": chemotherapy,
+        "endocrine": (hr_state == 2).astype(np.int64), "targeted": (her2_state == 2).astype(np.int64),
+    }
+
+
+def patient_keys(frame):
+    """Keys for the columns accepted by ``ibtr_model.design_matrix``.
+
+    Flags must be 0/1 without missing values (ValueError naming the column).
+    """
+    n = len(np.asarray(frame["age"]))
+    codes = {column: category_codes(frame[column], column) for column in CATEGORICAL}
+    return keys_from_codes(**codes, **flag_columns(frame, n))
+
+
+def patient_key(input_dict):
+    """Key of one patient's ``input_dict``."""
+    codes = {}
+    for column, (_, levels) in CATEGORICAL.items():
+        codes[column] = [input_dict[var] for var in levels].index(1)
+    flags = {flag: input_dict[flag] for flag in VARIABLE_NAMES[14:]}
+    return int(keys_from_codes(**codes, **flags))
+
+
+def design_from_keys(keys):
+    """The N×21 design matrix of an array of keys."""
+    keys = np.atleast_1d(np.asarray(keys))
+    (age, margin, t_stage, grade, lvi, radiation, chemotherapy,
+     hr_state, her2_state) = np.unravel_index(keys, RADICES)
+    X = np.zeros((len(keys), len(VARIABLE_NAMES)))
+    rows = np.arange(len(keys))
+    for column, code in (("age", age), ("margin", margin), ("t_stage", t_stage), ("grade", grade)):
+        X[rows, VARIABLE_NAMES.index(CATEGORICAL[column][1][0]) + code] = 1
+    for flag, value in (
+        ("lvi", lvi),
+        ("hormone_receptor", hr_state > 0),
+        ("her2", her2_state > 0),
+        ("radiation", radiation),
+        ("chemotherapy", chemotherapy),
+        ("endocrine", hr_state == 2),
+        ("targeted", her2_state == 2),
+    ):
+        X[:, VARIABLE_NAMES.index(flag)] = value
+    return X
+
+
+def enumerate_design():
+    """The TABLE_SIZE×21 design matrix of every key, in key order."""
+    return design_from_keys(np.arange(TABLE_SIZE))
+
+
+def build_table(model=DEFAULT_MODEL):
+    """Score every key once with the vectorized engine."""
+    scores = score(enumerate_design(), model)
+    values = np.stack([scores["risk"], scores["lower"], scores["upper"]], axis=-1)
+    return RiskTable(model.version, model_fingerprint(model), scores["horizons"], values)
+
+
+def lookup(table, keys):
+    """Table read for an array of keys, returned like ``ibtr_model.score``."""
+    values = table.values[np.asarray(keys)]
+    values = values.reshape(-1, len(table.horizons), 3)
+    return {
+        "horizons": table.horizons,
+        "risk": values[..., 0],
+        "lower": values[..., 1],
+        "upper": values[..., 2],
+    }
+
+
+def save_table(table, path):
+    np.savez(
+        path,
+        values=table.values,
+        horizons=np.array(table.horizons),
+        model_version=np.array(table.model_version),
+        fingerprint=np.array(table.fingerprint),
+        checksum=np.array(table_checksum(table)),
+    )
+
+
+def load_table(path, model=DEFAULT_MODEL):
+    """Load an artifact, checking its checksum and that it matches ``model``."""
+    with np.load(path, allow_pickle=False) as data:
+        table = RiskTable(
+            model_version=str(data["model_version"]),
+            fingerprint=str(data["fingerprint"]),
+            horizons=tuple(str(h) for h in data["horizons"]),
+            values=data["values"],
+        )
+        checksum = str(data["checksum"])
+    if table.values.shape[0] != TABLE_SIZE or table_checksum(table) != checksum:
+        raise ValueError(f"{path}: risk table checksum mismatch")
+    if model is not None and table.fingerprint != model_fingerprint(model):
+        raise ValueError(
+            f"{path}: risk table was built for model version {table.model_version}, "
+            f"not {model.version}"
+        )
+    return table
+
+
+_TABLES = {}
+_TABLES_LOCK = threading.Lock()
+
+
+def model_table(model=DEFAULT_MODEL):
+    """Table of ``model``, built once per model fingerprint.
+
+    The artifact at ``$IBTR_RISK_TABLE`` is used when it was built for the
+    same model; otherwise the table is built in memory.
+    """
+    fingerprint = model_fingerprint(model)
+    with _TABLES_LOCK:
+        table = _TABLES.get(fingerprint)
+        if table is None:
+            path = os.environ.get("IBTR_RISK_TABLE")
+            if path and load_table(path, model=None).fingerprint == fingerprint:
+                table = load_table(path, model)
+            else:
+                table = build_table(model)
+            _TABLES[fingerprint] = table
+        return table
+
+
+def default_table():
+    """Table of the default model."""
+    return model_table(DEFAULT_MODEL)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or verify the precomputed IBTR risk table.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="score every covariate combination and write an .npz artifact")
+    build.add_argument("-o", "--output", default=f"ibtr_risk_table_v{DEFAULT_MODEL.version}.npz")
+    verify = sub.add_parser("verify", help="check an artifact against the current model")
+    verify.add_argument("path")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        table = build_table()
+        save_table(table, args.output)
+        print(f"{args.output}: {TABLE_SIZE} profiles, model {table.model_version}, sha256 {table_checksum(table)}")
+    else:
+        table = load_table(args.path)
+        print(f"{args.path}: OK (model {table.model_version}, sha256 {table_checksum(table)})")
+
+
+if __name__ == "__main__":
+    main()
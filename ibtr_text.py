@@ -0,0 +1,240 @@
+## ibtr_text.py - Static texts (translations, CSS, footnotes) of the web app
+"""Static texts of ``ibtr_app_en.py``.
+
+Kept in an imported module so that they are built once per process instead of
+on every Streamlit rerun; ``static_sections`` returns the markdown blocks
+below the result area for one language.
+"""
+import functools
+
+# --- Safariフォント問題回避：システムネイティブフォント指定 ---
+FONT_CSS = """
+    <style>
+    html, body, [class*="css"] {
+        font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, Helvetica, Arial, sans-serif;
+    }
+    </style>
+    """
+
+BUTTON_CSS = """
+    <style>
+    div.stButton > button {
+        border: 2px solid red;
+        padding: 10px 25px;
+        font-size: 18px;
+        color: black;
+        background-color: white;
+        border-radius: 8px;
+        cursor: pointer;
+    }
+    </style>
+    """
+
+# Translation dictionary
+T = {
+    "title": {
+    "English": "IBTR Risk Estimation Tool<br>Integrating Real-World Data and Evidence from Meta-Analyses",
+    "日本語": "リアルワールドデータと<br>メタ解析に基づくIBTR発症率推定ツール"
+    },
+    # {version} はサーバーで使用中のモデルのバージョン
+    "version": {"English": "Version {version}", "日本語": "バージョン{version}"},
+    "scored_version": {"English": "Calculated with model version {version}", "日本語": "モデル バージョン{version}で計算"},
+    "description": {
+        "English": "This tool estimates the likelihood of Ipsilateral Breast Tumor Recurrence (IBTR) based on selected patient background and treatments.\nPlease select the clinical and pathological features below.",
+        "日本語": "このツールでは、同側乳房内再発（IBTR）の可能性を推定します。\n以下の臨床・病理情報を選択してください。"
+    },
+    "calculate": {"English": "Calculate IBTR Risk", "日本語": "乳房内再発リスクを計算"},
+    "estimated_risk": {"English": "Estimated IBTR risk at", "日本語": "推定された乳房内再発リスク（"},
+    "ci": {"English": "95% Confidence Interval", "日本語": "95%信頼区間"},
+    "curve_title": {"English": "Estimated IBTR risk over time (years after surgery)", "日本語": "術後年数ごとの乳房内再発リスク"},
+    "treatment_grid": {"English": "Compare treatment options", "日本語": "術後治療の組み合わせを比較"},
+    "treatment_grid_note": {
+        "English": "Absolute risk reduction (ARR) compared with no adjuvant therapy, for the patient characteristics above. Ranked by 10-year ARR.",
+        "日本語": "上記の患者背景で、術後治療なしと比べた絶対リスク減少（ARR）です。10年のARRの大きい順に表示しています。"
+    },
+    "treatment": {"English": "Treatment", "日本語": "治療"},
+    "risk": {"English": "risk", "日本語": "リスク"},
+    "no_treatment": {"English": "No adjuvant therapy", "日本語": "術後治療なし"},
+    "radiation": {"English": "Radiation", "日本語": "放射線療法"},
+    "chemotherapy": {"English": "Chemotherapy", "日本語": "化学療法"},
+    "endocrine": {"English": "Endocrine", "日本語": "内分泌療法"},
+    "targeted": {"English": "Anti-HER2", "日本語": "抗HER2療法"},
+    "contribution_title": {"English": "What drives this estimate", "日本語": "リスクに影響している因子"},
+    "contribution_note": {
+        "English": "Change in absolute risk attributable to each factor: the estimate minus the estimate with that factor removed (or set to the reference category), other factors unchanged.",
+        "日本語": "各因子による絶対リスクの変化です（推定値と、その因子がない場合〈または参照カテゴリの場合〉の推定値との差。他の因子は同じ）。"
+    },
+    "no_contribution": {
+        "English": "All factors are at their reference categories.",
+        "日本語": "すべての因子が参照カテゴリです。"
+    },
+    "points": {"English": "percentage points", "日本語": "%ポイント"}
+}
+
+# 寄与度グラフの変数名（多言語）
+VARIABLE_LABELS = {
+    "agecategory_<40": {"English": "Age under 40", "日本語": "40歳未満"},
+    "agecategory_40s": {"English": "Age 40s", "日本語": "40代"},
+    "agecategory_50s": {"English": "Age 50s", "日本語": "50代"},
+    "agecategory_60s": {"English": "Age 60s", "日本語": "60代"},
+    "agecategory_70+": {"English": "Age 70 or older", "日本語": "70歳以上"},
+    "finalmargin_negative": {"English": "Clear margin", "日本語": "陰性断端"},
+    "finalmargin_close(<5mm)": {"English": "Close margin (<5mm)", "日本語": "近接断端(<5mm)"},
+    "finalmargin_positive": {"English": "Involved margin", "日本語": "陽性断端"},
+    "pT_1": {"English": "pT1", "日本語": "pT1"},
+    "pT_2": {"English": "pT2", "日本語": "pT2"},
+    "pT_3": {"English": "pT3", "日本語": "pT3"},
+    "grade_1": {"English": "Grade 1", "日本語": "Grade 1"},
+    "grade_2": {"English": "Grade 2", "日本語": "Grade 2"},
+    "grade_3": {"English": "Grade 3", "日本語": "Grade 3"},
+    "lvi": {"English": "Lymphovascular invasion", "日本語": "脈管侵襲あり"},
+    "hormone_receptor": {"English": "Hormone receptor positive", "日本語": "ホルモン受容体陽性"},
+    "her2": {"English": "HER2 positive", "日本語": "HER2陽性"},
+    "radiation": {"English": "Radiation therapy", "日本語": "放射線療法"},
+    "chemotherapy": {"English": "Chemotherapy", "日本語": "化学療法"},
+    "endocrine": {"English": "Endocrine therapy", "日本語": "内分泌療法"},
+    "targeted": {"English": "Anti-HER2 therapy", "日本語": "抗HER2療法"}
+}
+
+# Footnote section (multilingual)
+FOOTNOTE = {
+    "日本語": """
+---
+### 本ツールについて
+このツールは、2008〜2017年に乳房温存術（部分切除術）を受けた浸潤性乳がん患者 8,938人を対象とした日本の多施設共同研究の結果に基づいて開発・検証されました。
+
+研究のポイント
+    •    乳房温存術後の乳房内再発（IBTR）のリスクを5年・10年で推定
+    •    年齢、腫瘍の大きさ、断端状況、グレード、リンパ管侵襲、ホルモン受容体やHER2の状態、術後治療（放射線、内分泌療法、化学療法など）を考慮
+    •    大規模メタアナリシス（EBCTCG）のデータを組み込み、治療効果を反映
+
+注意点
+    •    このツールはあくまで統計モデルに基づく推定であり、診断や治療を決定するものではありません。
+    •    特に40歳未満やまれな病理型など、対象患者が少ない条件では予測の幅が広くなるため、解釈には注意が必要です。
+    •    実際の診療では、主治医と相談のうえ治療方針を決定してください。
+
+発表について
+本研究成果は 2025年ASCO年次総会（演題番号575） にて発表され、JCO Clinical Cancer Informatics に論文掲載されています。  詳細な解析や方法については論文をご参照ください。
+https://ascopubs.org/doi/10.1200/CCI-25-00182
+  
+
+### iPhoneおよびiPad版ツール 
+インターネット環境がなくても利用できるiPhoneおよびiPad向けアプリとなります。10年間のIBTRリスクの推定に加え、選択した術後治療の効果を視覚的に分かりやすく提示することが可能です。
+https://apps.apple.com/jp/app/ibtr-risk-estimation/id6744888499
+
+### 免責事項
+このツールは学術目的および教育目的のために提供されており、医学的助言、診断、治療の代替とはなりません。医療上の判断は必ず医療従事者にご相談ください。
+""",
+    "English": """
+---
+### About this tool
+This tool was developed based on a multi-center study of 8,938 women in Japan who underwent breast-conserving surgery (partial mastectomy) for invasive breast cancer between 2008 and 2017. Patients who had mastectomy conversion, received neoadjuvant chemotherapy, had bilateral/multiple cancers, or lacked essential data were excluded.
+
+The model estimates the risk of ipsilateral breast tumor recurrence (IBTR) at 5 and 10 years after surgery. It incorporates clinical and pathological factors (such as age, tumor size, margin status, grade, lymphovascular invasion, hormone receptor and HER2 status) as well as the effects of adjuvant therapies (chemotherapy, endocrine therapy, and radiotherapy). Treatment effects were informed by large-scale EBCTCG meta-analyses.
+
+Key points
+    •    Risk estimates are generated using robust statistical methods and internally validated.
+    •    Results are presented with 95% confidence intervals, showing the uncertainty range.
+    •    In smaller subgroups (e.g., patients under 40 years or with rare tumor types), the prediction intervals are wider, so results should be interpreted with caution.
+    •    This tool is designed to support discussion between patients and physicians, not to replace medical advice.
+
+Publication
+The methodology was presented at the 2025 ASCO Annual Meeting (Abstract No. 575) and published in JCO Clinical Cancer Informatics (Sagara et al., 2025). For detailed methods and results, please refer to the published article(https://ascopubs.org/doi/10.1200/CCI-25-00182).
+
+### iPhone and iPad version
+An iPhone and iPad version of the app is available now, designed to work offline without the need for an internet connection. This application provides not only a 10-year IBTR risk estimate but also a visual representation of the anticipated effects of selected treatment options. 
+    https://apps.apple.com/jp/app/ibtr-risk-estimation/id6744888499
+
+### Disclaimer
+This tool is intended for academic and educational purposes only. It is not a substitute for professional medical advice, diagnosis, or treatment. Please consult with a healthcare provider for medical guidance.
+""",
+}
+
+# Version history (multilingual)
+VERSION_HISTORY = {
+    "日本語": """
+---
+### バージョン履歴
+- ver1.0（2025年4月11日公表）：初期バージョン
+- ver1.5（2025年4月17日更新）：データ整合性の見直しを行い、一部症例のIBTRイベント情報および分類を修正。
+- ver1.6（2025年5月23日更新）：変数の名称を変更
+- ver1.61（2025年9月16日更新）：本ツール説明を変更
+""",
+    "English": """
+---
+### Version History
+- ver1.0 (Released on April 11, 2025): Initial version
+- ver1.5 (Updated on April 17, 2025): Minor revisions made to ensure data consistency, including adjustments to IBTR event classification.
+- ver1.6 (Updated on May 23, 2025): Variable names revised
+- ver1.61 (Updated on Sep 16, 2025): Explanation of this tool revised
+""",
+}
+
+# --- Credit and Feedback section (multilingual) ---
+CREDIT = {
+    "日本語": """
+### クレジット
+日本乳癌学会第29回研究班（班長：坂井威彦）において多施設共同研究が行われました。モデルの開発と検証およびウェブアプリの実装は、相良安昭により主に行われました。
+
+© 日本乳癌学会第29回研究班  
+出典を明記した上での学術・教育目的での引用・共有を歓迎します。無断の商用利用や改変はご遠慮ください。
+
+### フィードバックのお願い
+本ツールに関するご意見や不具合のご報告などがありましたら、以下のフォームよりお寄せください。  
+いただいた内容は今後の改良や学術的評価の参考にさせていただきます。
+
+[フィードバックフォームはこちら](https://docs.google.com/forms/d/e/1FAIpQLScZOEWa4osyS0K9Xg9Fq0p1EGeyyIOqXvfdkyxj07l9vyeGZw/viewform)
+""",
+    "English": """
+### Credit
+This multi-institutional research was conducted under the 29th Research Task Force of the Japanese Breast Cancer Society (Team Leader: Takehiko Sakai, MD, PhD).
+
+Yasuaki Sagara, MD, MPH primarily developed and validated the prediction model and web application tool.
+
+© 2025 Japanese Breast Cancer Society, Task Force 29  
+Academic and educational use with proper attribution is encouraged. Commercial use or modification without permission is not allowed.
+
+### Feedback
+If you have any comments, suggestions, or would like to report a technical issue related to this tool, please feel free to use the form below (optional).  
+Your feedback will help us improve the tool in future updates and academic evaluations.
+
+[Click here to access the feedback form](https://docs.google.com/forms/d/e/1FAIpQLScZOEWa4osyS0K9Xg9Fq0p1EGeyyIOqXvfdkyxj07l9vyeGZw/viewform)
+""",
+}
+
+# --- Privacy Policy Section (multilingual) ---
+PRIVACY = {
+    "日本語": """
+### プライバシーポリシー
+
+本ウェブツールとiOSのアプリケーション（IBTR Risk Estimation）は、医療従事者による乳房内再発（IBTR）リスクの説明支援を目的として開発されたツールです。
+
+本アプリでは、以下のとおりユーザーのプライバシーを尊重し、個人情報の収集・保存・送信は一切行いません。
+
+- ユーザーの氏名、メールアドレス、位置情報、デバイス識別子等の個人情報は収集しません。
+- 入力された臨床情報や計算結果はすべて端末内で処理され、外部サーバーに送信されません。
+- いかなる情報も第三者へ提供されることはありません。
+- 本アプリは広告配信機能を使用していません。
+- 本プライバシーポリシーに関するご質問は、上記のフィードバックフォームにてご連絡ください。
+""",
+    "English": """
+### Privacy Policy
+
+The IBTR Risk Estimation web tool and iOS application is a non-commercial medical support tool designed to assist healthcare professionals in explaining the risk of ipsilateral breast tumor recurrence (IBTR).
+
+This app fully respects user privacy and does not collect, store, or transmit any personal information.
+
+- No personal data such as name, email address, location, or device identifiers is collected.
+- All entered clinical data and results are processed locally on your device and are not transmitted to external servers.
+- No information is shared with third parties.
+- This app does not use any advertising.
+- If you have any questions regarding this privacy policy, please contact us using the feedback form above.
+""",
+}
+
+
+
+@functools.lru_cache(maxsize=None)
+def static_sections(lang):
+    """Markdown blocks rendered below the result area, in display order."""
+    return (FOOTNOTE[lang], VERSION_HISTORY[lang], "---", CREDIT[lang], "---", PRIVACY[lang])
@@ -0,0 +1,147 @@
+## ibtr_uncertainty.py - Covariance-aware confidence intervals (delta method / Monte Carlo)
+"""Confidence intervals that use a full variance–covariance matrix.
+
+The parameters are the 21 log-HRs in ``variables`` order followed by the log
+baseline cumulative hazard ``log(-log S0(h))`` of every horizon, see
+``param_names``.  For horizon ``h`` the linear predictor of a patient ``x`` is
+``eta = x·beta + log H0(h)`` and the risk is ``1 - exp(-exp(eta))``, which is
+the same as ``1 - S0 ** exp(xb)`` in ``ibtr_model.score``.
+
+``default_covariance`` is diag(SE²) with no baseline uncertainty; with it,
+``delta_method`` reproduces the intervals of ``ibtr_model.score`` exactly.
+"""
+import os
+
+import numpy as np
+
+from ibtr_model import DEFAULT_MODEL, N_VARIABLES, VARIABLE_NAMES, Z_95, hazard_grid, horizon_years
+
+
+def param_names(model=DEFAULT_MODEL):
+    return VARIABLE_NAMES + [f"log_H0_{year}" for year in model.baseline_survival]
+
+
+def param_mean(model=DEFAULT_MODEL):
+    """Point estimates of the parameters."""
+    H0 = hazard_grid([horizon_years(year) for year in model.baseline_survival], model)
+    return np.concatenate([model.log_hr, np.log(H0)])
+
+
+def default_covariance(model=DEFAULT_MODEL):
+    """diag(SE²) for the log-HRs, zero variance for the baseline."""
+    variances = np.zeros(N_VARIABLES + len(model.baseline_survival))
+    variances[:N_VARIABLES] = model.se ** 2
+    return np.diag(variances)
+
+
+def as_covariance(cov, model=DEFAULT_MODEL):
+    """Validate ``cov``; a 21×21 log-HR matrix is padded with a fixed baseline."""
+    n_params = N_VARIABLES + len(model.baseline_survival)
+    if cov is None:
+        return default_covariance(model)
+    cov = np.asarray(cov, dtype=float)
+    if cov.shape == (N_VARIABLES, N_VARIABLES):
+        full = np.zeros((n_params, n_params))
+        full[:N_VARIABLES, :N_VARIABLES] = cov
+        cov = full
+    if cov.shape != (n_params, n_params):
+        raise ValueError(f"covariance must be {N_VARIABLES}x{N_VARIABLES} or {n_params}x{n_params}, got {cov.shape}")
+    if not np.allclose(cov, cov.T):
+        raise ValueError("covariance must be symmetric")
+    return cov
+
+
+def load_covariance(path, model=DEFAULT_MODEL):
+    """Read a covariance matrix from ``.npy`` (in ``param_names`` order) or CSV.
+
+    A CSV file has the parameter names as header and first column; it is
+    reordered to ``param_names`` and may omit the baseline rows.
+    """
+    if os.path.splitext(path)[1].lower() == ".npy":
+        return as_covariance(np.load(path), model)
+    import pandas as pd
+
+    frame = pd.read_csv(path, index_col=0)
+    names = [name for name in param_names(model) if name in frame.index]
+    if names != param_names(model) and names != VARIABLE_NAMES:
+        missing = sorted(set(VARIABLE_NAMES) - set(frame.index))
+        raise ValueError(f"{path}: missing covariance rows {missing}")
+    return as_covariance(frame.loc[names, names].to_numpy(), model)
+
+
+def _risks(eta):
+    return -np.expm1(-np.exp(eta))
+
+
+def delta_method(X, cov=None, model=DEFAULT_MODEL, z=Z_95):
+    """Analytic intervals for a whole batch.
+
+    ``var(eta) = x'Σββx + 2x'Σβh + Σhh`` is evaluated for all rows with one
+    N×21 by 21×(21+H) matrix product.  Returns ``horizons``, ``xb`` and
+    ``se_eta``/``risk``/``lower``/``upper`` of shape (N, H).
+    """
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    cov = as_covariance(cov, model)
+    XS = X @ cov[:N_VARIABLES, :]
+    var = (
+        np.einsum("ij,ij->i", XS[:, :N_VARIABLES], X)[:, None]
+        + 2 * XS[:, N_VARIABLES:]
+        + np.diag(cov)[N_VARIABLES:][None, :]
+    )
+    se_eta = np.sqrt(np.maximum(var, 0.0))
+    xb = X @ model.log_hr
+    eta = xb[:, None] + param_mean(model)[N_VARIABLES:][None, :]
+    return {
+        "horizons": tuple(model.baseline_survival),
+        "xb": xb,
+        "se_eta": se_eta,
+        "risk": _risks(eta),
+        "lower": _risks(eta - z * se_eta),
+        "upper": _risks(eta + z * se_eta),
+    }
+
+
+def draw_parameters(cov=None, model=DEFAULT_MODEL, draws=1000, seed=None):
+    """K×(21+H) multivariate normal parameter draws, reproducible for a seed.
+
+    Draw once and pass the result to ``monte_carlo`` for every chunk of a
+    cohort so that all patients share the same K draws.
+    """
+    rng = np.random.default_rng(seed)
+    return rng.multivariate_normal(param_mean(model), as_covariance(cov, model), size=draws, method="eigh")
+
+
+def monte_carlo(X, theta=None, cov=None, model=DEFAULT_MODEL, draws=1000, seed=None, level=0.95):
+    """Simulation intervals from K shared parameter draws.
+
+    The K×N linear predictors come from one ``theta @ X.T`` product; the
+    interval is the central ``level`` quantile range over the draws.  Returns
+    the same keys as ``delta_method`` plus ``mean`` (the average simulated
+    risk); ``risk`` is the point estimate.  The K×N array is held in memory,
+    so score large cohorts chunk by chunk with the same ``theta``.
+    """
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    if theta is None:
+        theta = draw_parameters(cov, model, draws, seed)
+    eta = theta[:, :N_VARIABLES] @ X.T
+    alpha = (1 - level) / 2
+    horizons = tuple(model.baseline_survival)
+    log_h0 = param_mean(model)[N_VARIABLES:]
+    xb = X @ model.log_hr
+    risk = np.empty((X.shape[0], len(horizons)))
+    mean = np.empty_like(risk)
+    lower = np.empty_like(risk)
+    upper = np.empty_like(risk)
+    for j in range(len(horizons)):
+        simulated = _risks(eta + theta[:, N_VARIABLES + j][:, None])
+        risk[:, j] = _risks(xb + log_h0[j])
+        mean[:, j] = simulated.mean(axis=0)
+        lower[:, j], upper[:, j] = np.quantile(simulated, [alpha, 1 - alpha], axis=0)
+    return {
+        "horizons": horizons,
+        "xb": xb,
+        "risk": risk,
+        "mean": mean,
+        "lower": lower,
+        "upper": upper,
+    }
@@ -0,0 +1,271 @@
+## ibtr_validation.py - Discrimination and calibration of the model on a local cohort
+"""Validation metrics for the 5y/10y predictions.
+
+All metrics take the output of ``ibtr_model.score`` (``xb`` and the
+``risk`` matrix) together with the observed follow-up ``time`` in years and
+the IBTR ``event`` indicator (1 = IBTR, 0 = censored).  They are computed
+with sorting, cumulative sums and ``searchsorted`` only, so cost is
+O(n log n); a 500,000-patient cohort takes a few seconds.
+
+* Harrell's C: a pair is comparable when the shorter time is an IBTR; a
+  censored time tied with an IBTR counts as the longer one, pairs of tied
+  IBTRs are not comparable and ties in the marker count 1/2.  Per horizon
+  only IBTRs up to the horizon are used (truncated C).
+* Time-dependent AUC (cumulative/dynamic): cases are IBTRs up to the
+  horizon weighted by 1 / G(T-), controls are patients still free of IBTR
+  at the horizon (Uno et al. 2007); G is the Kaplan–Meier estimate of the
+  censoring distribution.
+* Brier score with inverse probability of censoring weights (Graf et al.
+  1999), and the Brier score of the Kaplan–Meier risk as a reference.
+* Calibration-in-the-large: Kaplan–Meier observed risk against the mean
+  predicted risk (O/E and O − E).
+* Calibration slope: Cox regression of follow-up censored at the horizon on
+  ``xb`` (1 = perfectly calibrated spread of risk).
+
+    python ibtr_validation.py cohort.csv --time followup_years --event ibtr
+"""
+import argparse
+
+import numpy as np
+
+from ibtr_model import flag_values, horizon_years
+
+SLOPE_MAX_ITER = 50
+
+
+def event_indicator(event, column="event"):
+    """IBTR indicator as bool; values must be 0/1 (or booleans) without missing values."""
+    return flag_values(event, column).astype(bool)
+
+
+def _as_arrays(time, event, *markers):
+    time = np.asarray(time, dtype=float)
+    event = event_indicator(event)
+    if time.shape != event.shape or time.ndim != 1:
+        raise ValueError("time and event must be 1-d arrays of the same length")
+    if np.any(time < 0) or not np.all(np.isfinite(time)):
+        raise ValueError("time must be finite and non-negative")
+    out = [time, event]
+    for marker in markers:
+        marker = np.asarray(marker, dtype=float)
+        if marker.shape != time.shape:
+            raise ValueError("markers must have one value per patient")
+        out.append(marker)
+    return out
+
+
+def kaplan_meier(time, event):
+    """Distinct times and the Kaplan–Meier survival right after each of them."""
+    times, inverse = np.unique(time, return_inverse=True)
+    counts = np.bincount(inverse)
+    at_risk = len(time) - np.concatenate([[0], np.cumsum(counts)[:-1]])
+    events = np.bincount(inverse, weights=event)
+    return times, np.cumprod(1 - events / at_risk)
+
+
+def step_value(times, values, t, left=False):
+    """Right-continuous step function (or its left limit) at ``t``; 1 before the first time."""
+    idx = np.searchsorted(times, t, side="left" if left else "right") - 1
+    return np.where(idx >= 0, values[np.maximum(idx, 0)], 1.0)
+
+
+def censoring_survival(time, event):
+    """Kaplan–Meier estimate G of the censoring distribution."""
+    return kaplan_meier(time, ~np.asarray(event, dtype=bool))
+
+
+def _later_smaller(v):
+    """For each position p, the number of positions q > p with v[q] < v[p].
+
+    Bottom-up merge counting: at every level each block is split into a left
+    and a right half, and the left elements are searched in the sorted right
+    halves of all blocks at once.  ``v`` holds non-negative integer ranks.
+    """
+    n = len(v)
+    counts = np.zeros(n, dtype=np.int64)
+    pos = np.arange(n)
+    stride = int(v.max(initial=0)) + 1
+    width = 1
+    while width < n:
+        block = pos // (2 * width)
+        right = (pos // width) % 2 == 1
+        keys = np.sort(block[right] * stride + v[right])
+        # 右半分はブロック順に width 個ずつ並ぶので、ブロック b の先頭は b * width
+        left_block = block[~right]
+        counts[~right] += np.searchsorted(keys, left_block * stride + v[~right]) - left_block * width
+        width *= 2
+    return counts
+
+
+def concordance_counts(time, event, marker):
+    """Per patient: later times, and among them smaller and equal markers.
+
+    A censored time tied with an IBTR counts as the later one.  Harrell's C
+    over any subset of IBTRs is a ratio of sums of these counts.
+    """
+    time, event, marker = _as_arrays(time, event, marker)
+    n = len(time)
+    # 同時刻では打ち切りをイベントの後に並べる
+    order_t = 2 * np.searchsorted(np.unique(time), time) + ~event
+    ranks = np.unique(marker, return_inverse=True)[1].astype(np.int64)
+
+    smaller = np.empty(n, dtype=np.int64)
+    order = np.lexsort((ranks, order_t))
+    smaller[order] = _later_smaller(ranks[order])
+    later = n - np.searchsorted(np.sort(order_t), order_t, side="right")
+    stride = int(order_t.max(initial=0)) + 1
+    keys = np.sort(ranks * stride + order_t)
+    tied = (np.searchsorted(keys, (ranks + 1) * stride)
+            - np.searchsorted(keys, ranks * stride + order_t, side="right"))
+    return later, smaller, tied
+
+
+def harrell_c(time, event, marker, tau=None, counts=None):
+    """Harrell's concordance of ``marker`` (higher = earlier IBTR).
+
+    ``counts`` from ``concordance_counts`` can be passed to reuse them
+    across horizons.
+    """
+    time, event = _as_arrays(time, event)
+    later, smaller, tied = counts if counts is not None else concordance_counts(time, event, marker)
+    use = event if tau is None else event & (time <= tau)
+    comparable = later[use].sum()
+    if comparable == 0:
+        return np.nan
+    return (smaller[use].sum() + 0.5 * tied[use].sum()) / comparable
+
+
+def time_auc(time, event, marker, tau):
+    """Cumulative/dynamic AUC at ``tau`` with IPCW case weights."""
+    time, event, marker = _as_arrays(time, event, marker)
+    g_times, G = censoring_survival(time, event)
+    cases = event & (time <= tau)
+    controls = np.sort(marker[time > tau])
+    if not cases.any() or len(controls) == 0:
+        return np.nan
+    weights = 1 / step_value(g_times, G, time[cases], left=True)
+    less = np.searchsorted(controls, marker[cases], side="left")
+    ties = np.searchsorted(controls, marker[cases], side="right") - less
+    return float(np.sum(weights * (less + 0.5 * ties)) / (weights.sum() * len(controls)))
+
+
+def brier_score(time, event, risk, tau):
+    """IPCW Brier score of the predicted risk at ``tau``."""
+    time, event, risk = _as_arrays(time, event, risk)
+    g_times, G = censoring_survival(time, event)
+    cases = event & (time <= tau)
+    controls = time > tau
+    weights = np.zeros(len(time))
+    weights[cases] = 1 / step_value(g_times, G, time[cases], left=True)
+    G_tau = step_value(g_times, G, tau)
+    weights[controls] = 1 / G_tau if G_tau > 0 else np.nan
+    return float(np.mean(weights * (cases - risk) ** 2))
+
+
+def cox_slope(time, event, x):
+    """Coefficient and SE of a one-variable Cox model (Breslow ties)."""
+    time, event, x = _as_arrays(time, event, x)
+    order = np.argsort(-time, kind="stable")
+    t, d, x = time[order], event[order], x[order]
+    # 各患者のリスク集合 {T >= t} の末尾（時間降順）
+    end = np.searchsorted(-t, -t, side="right") - 1
+    beta = 0.0
+    info = np.nan
+    for _ in range(SLOPE_MAX_ITER):
+        bx = beta * x
+        w = np.exp(bx - bx.max(initial=0.0))
+        s0 = np.cumsum(w)[end][d]
+        s1 = np.cumsum(w * x)[end][d]
+        s2 = np.cumsum(w * x * x)[end][d]
+        mean = s1 / s0
+        score = np.sum(x[d] - mean)
+        info = np.sum(s2 / s0 - mean ** 2)
+        if not info > 0:
+            return np.nan, np.nan
+        step = score / info
+        beta += step
+        if abs(step) < 1e-10:
+            break
+    return beta, 1 / np.sqrt(info)
+
+
+def calibration(time, event, risk, xb, tau):
+    """Calibration-in-the-large and calibration slope at ``tau``."""
+    time, event, risk, xb = _as_arrays(time, event, risk, xb)
+    km_times, S = kaplan_meier(time, event)
+    observed = 1 - float(step_value(km_times, S, tau))
+    expected = float(risk.mean())
+    slope, slope_se = cox_slope(np.minimum(time, tau), event & (time <= tau), xb)
+    return {
+        "observed": observed,
+        "expected": expected,
+        "oe": observed / expected,
+        "citl": observed - expected,
+        "slope": slope,
+        "slope_se": slope_se,
+    }
+
+
+def validate(scores, time, event):
+    """All metrics for the output of ``ibtr_model.score`` (or ``ibtr_table.lookup`` plus ``xb``).
+
+    Returns ``n``, ``events``, the overall ``c_index`` of ``xb`` and per
+    horizon ``c_index`` (truncated), ``auc``, ``brier``, ``brier_km``,
+    ``observed``, ``expected``, ``oe``, ``citl``, ``slope`` and ``slope_se``.
+    """
+    time, event, xb = _as_arrays(time, event, scores["xb"])
+    km_times, S = kaplan_meier(time, event)
+    counts = concordance_counts(time, event, xb)
+    result = {"n": len(time), "events": int(event.sum()), "c_index": harrell_c(time, event, xb, counts=counts)}
+    for j, year in enumerate(scores["horizons"]):
+        tau = horizon_years(year)
+        risk = np.asarray(scores["risk"])[:, j]
+        km_risk = np.full(len(time), 1 - float(step_value(km_times, S, tau)))
+        result[year] = {
+            "c_index": harrell_c(time, event, xb, tau, counts),
+            "auc": time_auc(time, event, xb, tau),
+            "brier": brier_score(time, event, risk, tau),
+            "brier_km": brier_score(time, event, km_risk, tau),
+            **calibration(time, event, risk, xb, tau),
+        }
+    return result
+
+
+def main(argv=None):
+    from ibtr_batch import read_chunks
+    from ibtr_model import design_matrix, score
+    from ibtr_registry import current_model, default_registry
+
+    parser = argparse.ArgumentParser(description="Validate the IBTR model on a cohort file with follow-up.")
+    parser.add_argument("input", help="CSV or Parquet file with the model inputs, follow-up and event")
+    parser.add_argument("--time", default="time", help="follow-up column in years (default: time)")
+    parser.add_argument("--event", default="event", help="IBTR indicator column (default: event)")
+    parser.add_argument("--version", help="model version (default: the served version)")
+    parser.add_argument("--chunksize", type=int, default=100_000)
+    args = parser.parse_args(argv)
+
+    model = default_registry().get(args.version) if args.version else current_model()
+    parts = {"xb": [], "risk": [], "time": [], "event": []}
+    horizons = None
+    for frame in read_chunks(args.input, args.chunksize):
+        scores = score(design_matrix(frame), model)
+        horizons = scores["horizons"]
+        parts["xb"].append(scores["xb"])
+        parts["risk"].append(scores["risk"])
+        parts["time"].append(frame[args.time].to_numpy(dtype=float))
+        parts["event"].append(event_indicator(frame[args.event].to_numpy(), args.event))
+    if horizons is None:
+        parser.error(f"{args.input}: no rows")
+    scores = {"horizons": horizons, "xb": np.concatenate(parts["xb"]), "risk": np.concatenate(parts["risk"])}
+    result = validate(scores, np.concatenate(parts["time"]), np.concatenate(parts["event"]))
+
+    print(f"model v{model.version}: n={result['n']}, IBTR={result['events']}, Harrell's C={result['c_index']:.3f}")
+    for year in horizons:
+        m = result[year]
+        print(f"{year}: C={m['c_index']:.3f} AUC={m['auc']:.3f} Brier={m['brier']:.4f} (KM {m['brier_km']:.4f}) "
+              f"O={m['observed']*100:.1f}% E={m['expected']*100:.1f}% O/E={m['oe']:.2f} "
+              f"slope={m['slope']:.2f} (SE {m['slope_se']:.2f})")
+
+
+if __name__ == "__main__":
+    main()
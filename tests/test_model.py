@@ -0,0 +1,144 @@
+"""The vectorized engine against the original per-patient loop of the app."""
+import re
+
+import numpy as np
+import pytest
+
+from ibtr_model import (CATEGORICAL, FLAGS, baseline_survival, design_matrix, design_row,
+                        make_input_dict, score, score_into, variables)
+from ibtr_table import TABLE_SIZE, codes_from_keys
+
+
+def loop_results(input_dict):
+    """The risk calculation of the original app, one patient at a time."""
+    xb = 0.0
+    se_sum = 0.0
+    for var, label, loghr, se in variables:
+        value = input_dict[var]
+        xb += loghr * value
+        se_sum += (se * value) ** 2
+    se_total = np.sqrt(se_sum)
+    results = {}
+    for year, S0 in baseline_survival.items():
+        risk = 1 - S0 ** np.exp(xb)
+        risk_lower = 1 - S0 ** np.exp(xb - 1.96 * se_total)
+        risk_upper = 1 - S0 ** np.exp(xb + 1.96 * se_total)
+        results[year] = (risk, risk_lower, risk_upper)
+    return xb, se_total, results
+
+
+def random_patients(n, seed=0):
+    rng = np.random.default_rng(seed)
+    frame = {column: rng.choice(list(mapping), n) for column, (mapping, _) in CATEGORICAL.items()}
+    for flag in FLAGS:
+        frame[flag] = rng.integers(0, 2, n)
+    frame["endocrine"] *= frame["hormone_receptor"]
+    frame["targeted"] *= frame["her2"]
+    return frame
+
+
+def patient(frame, i):
+    return make_input_dict(**{column: frame[column][i] for column in [*CATEGORICAL, *FLAGS]})
+
+
+@pytest.fixture(scope="module")
+def patients():
+    return random_patients(500)
+
+
+def test_score_matches_loop(patients):
+    scores = score(design_matrix(patients))
+    for i in range(len(patients["age"])):
+        xb, se_total, results = loop_results(patient(patients, i))
+        assert scores["xb"][i] == pytest.approx(xb, rel=1e-12, abs=1e-12)
+        assert scores["se_total"][i] == pytest.approx(se_total, rel=1e-12)
+        for j, year in enumerate(scores["horizons"]):
+            expected = results[year]
+            actual = (scores["risk"][i, j], scores["lower"][i, j], scores["upper"][i, j])
+            assert actual == pytest.approx(expected, rel=1e-9)
+
+
+def test_score_one_row_matches_loop():
+    input_dict = make_input_dict("40s", "Involved (tumor on ink)", "pT2", "Grade 3", lvi=True, hormone_receptor=True,
+                                 radiation=True, endocrine=True)
+    scores = score(design_row(input_dict))
+    _, _, results = loop_results(input_dict)
+    for j, year in enumerate(scores["horizons"]):
+        assert (scores["risk"][0, j], scores["lower"][0, j], scores["upper"][0, j]) == pytest.approx(
+            results[year], rel=1e-9)
+
+
+def test_score_into_matches_score(patients):
+    scores = score(design_matrix(patients))
+    out = score_into(patients)
+    np.testing.assert_allclose(out["xb"], scores["xb"], rtol=1e-14, atol=1e-14)
+    np.testing.assert_allclose(out["se_total"], scores["se_total"], rtol=1e-14)
+    for j, year in enumerate(scores["horizons"]):
+        for kind in ("risk", "lower", "upper"):
+            np.testing.assert_allclose(out[f"{kind}_{year}"], scores[kind][:, j], rtol=1e-13)
+
+
+def code_input_dict(codes, i):
+    """``input_dict`` of row ``i`` of category codes and flags."""
+    input_dict = {var: 0 for var, _, _, _ in variables}
+    for column, (_, levels) in CATEGORICAL.items():
+        input_dict[levels[codes[column][i]]] = 1
+    input_dict.update({flag: int(codes[flag][i]) for flag in FLAGS})
+    return input_dict
+
+
+def test_score_into_every_profile():
+    """Every valid profile, given as integer codes, against the loop."""
+    codes = codes_from_keys(np.arange(TABLE_SIZE))
+    out = score_into(codes)
+    for i in range(TABLE_SIZE):
+        xb, se_total, results = loop_results(code_input_dict(codes, i))
+        assert out["xb"][i] == pytest.approx(xb, rel=1e-12, abs=1e-12)
+        assert out["se_total"][i] == pytest.approx(se_total, rel=1e-12)
+        for year, (risk, lower, upper) in results.items():
+            assert (out[f"risk_{year}"][i], out[f"lower_{year}"][i], out[f"upper_{year}"][i]) == pytest.approx(
+                (risk, lower, upper), rel=1e-9)
+
+
+def test_score_into_writes_into_given_buffers(patients):
+    n = len(patients["age"])
+    out = {name: np.full(n, np.nan) for name in score_into(patients)}
+    result = score_into(patients, out=out)
+    assert result is out
+    assert not any(np.isnan(values).any() for values in out.values())
+
+
+@pytest.mark.parametrize("flag, values, message", [
+    ("lvi", [0, 2, 1], "lvi: values must be 0 or 1"),
+    ("radiation", [0, np.nan, 1], "radiation: missing value(s)"),
+    ("chemotherapy", ["yes", "no", "no"], "chemotherapy: values must be 0 or 1"),
+])
+def test_invalid_flags_raise(flag, values, message):
+    frame = {**{column: [list(mapping)[0]] * 3 for column, (mapping, _) in CATEGORICAL.items()}, flag: values}
+    for engine in (design_matrix, score_into):
+        with pytest.raises(ValueError, match=re.escape(message)):
+            engine(frame)
+
+
+@pytest.mark.parametrize("flags, message", [
+    ({"endocrine": [1]}, "endocrine"),
+    ({"her2": [0], "targeted": [1]}, "targeted"),
+])
+def test_treatment_gating(flags, message):
+    frame = {**{column: [list(mapping)[0]] for column, (mapping, _) in CATEGORICAL.items()}, **flags}
+    for engine in (design_matrix, score_into):
+        with pytest.raises(ValueError, match=message):
+            engine(frame)
+
+
+def test_unknown_label_raises():
+    frame = {column: [list(mapping)[0]] for column, (mapping, _) in CATEGORICAL.items()}
+    frame["grade"] = ["Grade 4"]
+    with pytest.raises(ValueError, match="grade: unknown label"):
+        score_into(frame)
+
+
+def test_published_models_match_sources():
+    from ibtr_registry import check_sources
+
+    assert check_sources() == []
@@ -0,0 +1,168 @@
+"""The scoring service through its ASGI interface, with an in-process client."""
+import asyncio
+import json
+
+import numpy as np
+import pytest
+
+from ibtr_model import design_matrix, score
+from ibtr_registry import current_model
+from ibtr_service import ScoringApp
+
+PATIENT = {"age": "50s", "margin": "Close (<5mm)", "t_stage": "pT1", "grade": "Grade 2",
+           "hormone_receptor": True, "endocrine": True}
+
+
+def request(app, method, path, body=None):
+    """(status, JSON payload) of one request sent straight to the ASGI app."""
+    if body is not None and not isinstance(body, bytes):
+        body = json.dumps(body).encode()
+    messages = [{"type": "http.request", "body": body or b"", "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": method, "path": path, "headers": []}
+    asyncio.run(app(scope, receive, send))
+    start, response = sent
+    assert start["type"] == "http.response.start"
+    assert dict(start["headers"])[b"content-length"] == str(len(response["body"])).encode()
+    return start["status"], json.loads(response["body"])
+
+
+@pytest.fixture
+def app():
+    app = ScoringApp(workers=1)
+    yield app
+    app.shutdown()
+
+
+def expected_risk(patients):
+    frame = {key: [p.get(key, False) for p in patients] for key in {k for p in patients for k in p}}
+    return score(design_matrix(frame), current_model())
+
+
+def test_health(app):
+    assert request(app, "GET", "/health") == (200, {"status": "ok", "model_version": current_model().version})
+    assert request(app, "POST", "/health")[0] == 405
+    assert request(app, "GET", "/nowhere")[0] == 404
+
+
+def test_score(app):
+    status, payload = request(app, "POST", "/score", PATIENT)
+    assert status == 200
+    assert payload["model_version"] == current_model().version
+    expected = expected_risk([PATIENT])
+    for j, year in enumerate(payload["horizons"]):
+        for kind in ("risk", "lower", "upper"):
+            assert payload[kind][year] == pytest.approx(expected[kind][0, j], rel=1e-12)
+
+
+def test_score_japanese_labels(app):
+    japanese = {**PATIENT, "age": "50代", "margin": "近接断端(<5mm)"}
+    assert request(app, "POST", "/score", japanese) == request(app, "POST", "/score", PATIENT)
+
+
+@pytest.mark.parametrize("patient, field", [
+    ({**PATIENT, "grade": "Grade 4"}, "grade"),
+    ({k: v for k, v in PATIENT.items() if k != "age"}, "age"),
+    ({**PATIENT, "lvi": "yes"}, "lvi"),
+    ({**PATIENT, "smoker": True}, "smoker"),
+    ({**PATIENT, "hormone_receptor": False}, "endocrine"),
+    ({**PATIENT, "targeted": True}, "targeted"),
+])
+def test_score_rejects_invalid_patient(app, patient, field):
+    status, payload = request(app, "POST", "/score", patient)
+    assert status == 422
+    assert [error["field"] for error in payload["errors"]] == [field]
+    assert "index" not in payload["errors"][0]
+
+
+def test_score_rejects_malformed_body(app):
+    assert request(app, "POST", "/score", b"{not json")[0] == 400
+    assert request(app, "GET", "/score")[0] == 405
+
+
+def random_patients(n, seed=0):
+    rng = np.random.default_rng(seed)
+    patients = []
+    for _ in range(n):
+        hr, her2 = bool(rng.integers(2)), bool(rng.integers(2))
+        patients.append({
+            "age": str(rng.choice(["Under 40", "40s", "50s", "60s", "70 or older"])),
+            "margin": str(rng.choice(["Clear (≥5mm)", "Close (<5mm)", "Involved (tumor on ink)"])),
+            "t_stage": str(rng.choice(["pT1", "pT2", "pT3"])),
+            "grade": str(rng.choice(["Grade 1", "Grade 2", "Grade 3"])),
+            "lvi": bool(rng.integers(2)), "radiation": bool(rng.integers(2)),
+            "chemotherapy": bool(rng.integers(2)),
+            "hormone_receptor": hr, "her2": her2,
+            "endocrine": hr and bool(rng.integers(2)), "targeted": her2 and bool(rng.integers(2)),
+        })
+    return patients
+
+
+def check_batch(payload, patients):
+    expected = expected_risk(patients)
+    assert len(payload["results"]) == len(patients)
+    for j, year in enumerate(payload["horizons"]):
+        for kind in ("risk", "lower", "upper"):
+            np.testing.assert_allclose([r[kind][year] for r in payload["results"]], expected[kind][:, j],
+                                       rtol=1e-12)
+
+
+def test_score_batch(app):
+    patients = random_patients(200)
+    status, payload = request(app, "POST", "/score/batch", {"patients": patients})
+    assert status == 200
+    assert payload["model_version"] == current_model().version
+    check_batch(payload, patients)
+    assert app._pool is None  # 閾値未満はイベントループ内で処理
+
+
+def test_score_batch_offloads_large_batches():
+    app = ScoringApp(workers=1, offload_threshold=50)
+    try:
+        patients = random_patients(120, seed=1)
+        status, payload = request(app, "POST", "/score/batch", {"patients": patients})
+        assert app._pool is not None
+        assert status == 200
+        check_batch(payload, patients)
+
+        patients[3]["endocrine"], patients[3]["hormone_receptor"] = True, False
+        status, payload = request(app, "POST", "/score/batch", {"patients": patients})
+        assert status == 422
+        assert {"index": 3, "field": "endocrine"}.items() <= payload["errors"][0].items()
+    finally:
+        app.shutdown()
+
+
+def test_score_batch_reports_every_invalid_patient(app):
+    patients = random_patients(5, seed=2)
+    patients[1]["margin"] = "Unknown"
+    patients[4]["targeted"], patients[4]["her2"] = True, False
+    status, payload = request(app, "POST", "/score/batch", {"patients": patients})
+    assert status == 422
+    assert [(e["index"], e["field"]) for e in payload["errors"]] == [(1, "margin"), (4, "targeted")]
+    assert request(app, "POST", "/score/batch", {"patients": {}})[0] == 422
+
+
+def test_lifespan_shuts_down_pool():
+    app = ScoringApp(workers=1, offload_threshold=0)
+    request(app, "POST", "/score/batch", {"patients": random_patients(2)})
+    assert app._pool is not None
+    messages = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message["type"])
+
+    asyncio.run(app({"type": "lifespan"}, receive, send))
+    assert sent == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+    assert app._pool is None
@@ -0,0 +1,53 @@
+"""Harrell's C against the O(n²) definition over all pairs."""
+import numpy as np
+import pytest
+
+from ibtr_validation import concordance_counts, harrell_c
+
+
+def reference_c(time, event, marker, tau=None):
+    """Pairs (i, j) with an IBTR at i before time j (a censored tie counts as later)."""
+    concordant = comparable = 0.0
+    for i in range(len(time)):
+        if not event[i] or (tau is not None and time[i] > tau):
+            continue
+        for j in range(len(time)):
+            if time[j] > time[i] or (time[j] == time[i] and not event[j]):
+                comparable += 1
+                if marker[i] > marker[j]:
+                    concordant += 1
+                elif marker[i] == marker[j]:
+                    concordant += 0.5
+    return concordant / comparable if comparable else np.nan
+
+
+def cohort(n, seed):
+    rng = np.random.default_rng(seed)
+    # 丸めて時刻・マーカーの同順位を多く含める
+    time = np.round(rng.exponential(8, n), 0) + 1
+    event = rng.random(n) < 0.4
+    marker = np.round(rng.normal(size=n) + 0.1 * (10 - time), 1)
+    return time, event, marker
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("tau", [None, 5.0, 10.0])
+def test_harrell_c_matches_pairwise(seed, tau):
+    time, event, marker = cohort(300, seed)
+    assert harrell_c(time, event, marker, tau) == pytest.approx(reference_c(time, event, marker, tau), rel=1e-12)
+
+
+def test_harrell_c_reuses_counts():
+    time, event, marker = cohort(200, 7)
+    counts = concordance_counts(time, event, marker)
+    for tau in (None, 3.0, 8.0):
+        assert harrell_c(time, event, marker, tau, counts=counts) == harrell_c(time, event, marker, tau)
+
+
+def test_harrell_c_without_comparable_pairs():
+    assert np.isnan(harrell_c([1.0, 2.0], [0, 0], [0.5, 0.1]))
+
+
+def test_event_must_be_0_or_1():
+    with pytest.raises(ValueError, match="event: values must be 0 or 1"):
+        harrell_c([1.0, 2.0], [0, 2], [0.5, 0.1])